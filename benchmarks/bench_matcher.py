@@ -0,0 +1,144 @@
+"""Times scanning, matching and whole -all runs against synthetic libraries.
+
+    python benchmarks/bench_matcher.py --files 10000 100000 1000000
+
+For each library size this builds a sparse synthetic library in a temporary directory, then reports:
+
+* scan: get_matching_files_in_dir_and_subdirs() without the scan index, while building it, and with a warm index
+* match: match() for every torrent, with changes recorded into a plan so no API time is included
+* run: a full matcher() -all run against an in-process fake Web API, with the number of requests per endpoint
+* run_warm: the same run repeated with the scan index, once to fill it and once timed, so file lists come
+  from the cache and torrents whose files are all in place are skipped
+
+Prompts for multiple matches are answered with "skip", so runs never block.
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import qbittorrent_file_matcher as qfm  # noqa: E402
+from fake_qbittorrent import FakeQbittorrent  # noqa: E402
+from synthetic_library import LibrarySpec, build_library  # noqa: E402
+from qbittorrentapi import TorrentFile  # noqa: E402
+
+
+@contextlib.contextmanager
+def timed(results: dict[str, Any], name: str, quiet: bool = True) -> Iterator[None]:
+    """Stores the wall time of the block in results[name], swallowing the matcher's output if quiet."""
+    output = io.StringIO() if quiet else sys.stdout
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        yield
+    results[name] = round(time.perf_counter() - start, 3)
+
+
+def skip_every_prompt(questions: list[dict[str, Any]]) -> dict[Any, str]:
+    return {"file": "<Skip this file>", 0: "no"}
+
+
+def bench_library(spec: LibrarySpec, workers: int, quiet: bool) -> dict[str, Any]:
+    results: dict[str, Any] = {"files": spec.files}
+    with tempfile.TemporaryDirectory(prefix="qfm-bench-") as tmp:
+        root = Path(tmp)
+        with timed(results, "build_library"):
+            torrents = build_library(root, spec)
+        library = root / "library"
+        # The scan index doesn't trust directories modified moments ago, so age them.
+        an_hour_ago = time.time() - 3600
+        for dirpath, _, _ in os.walk(library):
+            os.utime(dirpath, (an_hour_ago, an_hour_ago))
+        sizes = {file["size"] for torrent in torrents for file in torrent.files}
+        results["torrents"] = len(torrents)
+
+        with timed(results, "scan_no_index", quiet):
+            size_index = qfm.get_matching_files_in_dir_and_subdirs(library, sizes, False, None, workers)
+        scan_index = qfm.ScanIndex(root / "scan_index.db")
+        with timed(results, "scan_index_build", quiet):
+            qfm.get_matching_files_in_dir_and_subdirs(library, sizes, False, scan_index, workers)
+        with timed(results, "scan_index_warm", quiet):
+            qfm.get_matching_files_in_dir_and_subdirs(library, sizes, False, scan_index, workers)
+        scan_index.close()
+
+        options = qfm.MatchOptions(auto_pick_threshold=qfm.AUTO_PICK_THRESHOLD)
+        plan = qfm.Plan()
+        with timed(results, "match", quiet):
+            for torrent in torrents:
+                files = [TorrentFile(dict(file, index=index, id=index)) for index, file in enumerate(torrent.files)]
+                changes = qfm.PlannedTorrentChanges(plan, torrent.info["hash"], torrent.info["name"])
+                qfm.match(torrent.info, files, changes, size_index.view(library), library, options)  # type: ignore[arg-type]
+        results["planned_renames"] = sum(len(entry["renames"]) for entry in plan.torrents)
+
+        with FakeQbittorrent() as fake:
+            for torrent in torrents:
+                fake.add_torrent(dict(torrent.info), [dict(file) for file in torrent.files])
+            workdir = root / "workdir"
+            workdir.mkdir()
+            (workdir / "client.ini").write_text(f"[Client]\nhost = {fake.host}\nusername = admin\npassword = adminadmin\n")
+            cwd = os.getcwd()
+            os.chdir(workdir)
+            qfm.prompt = skip_every_prompt
+            try:
+                with timed(results, "run_all", quiet):
+                    qfm.matcher([], options, sync_all=True, scan_workers=workers, use_scan_index=False)
+                results["requests"] = sum(fake.requests.values())
+                results["requests_by_endpoint"] = dict(fake.requests.most_common())
+                results["bytes_sent"] = fake.bytes_sent
+
+                with contextlib.redirect_stdout(io.StringIO()):
+                    qfm.matcher([], options, sync_all=True, scan_workers=workers)
+                fake.reset_counters()
+                with timed(results, "run_warm", quiet):
+                    qfm.matcher([], options, sync_all=True, scan_workers=workers)
+                results["requests_warm"] = sum(fake.requests.values())
+            finally:
+                os.chdir(cwd)
+    return results
+
+
+def main() -> None:
+    defaults = LibrarySpec()
+    parser = argparse.ArgumentParser(description="Benchmarks the matcher against synthetic libraries")
+    parser.add_argument("--files", type=int, nargs="+", default=[10_000], help="Library sizes to run, e.g. 10000 100000 1000000.")
+    parser.add_argument("--depth", type=int, default=defaults.depth)
+    parser.add_argument("--fanout", type=int, default=defaults.fanout)
+    parser.add_argument("--collisions", type=float, default=defaults.collision_ratio, help="Share of files reusing an earlier file's size.")
+    parser.add_argument("--hardlinks", type=float, default=defaults.hardlink_ratio, help="Share of files created as hardlinks.")
+    parser.add_argument("--files-per-torrent", type=int, default=defaults.files_per_torrent)
+    parser.add_argument("--workers", type=int, default=qfm.DEFAULT_SCAN_WORKERS)
+    parser.add_argument("--json", action="store_true", help="Prints one JSON object per library size instead of a table.")
+    parser.add_argument("--verbose", action="store_true", help="Shows the matcher's own output.")
+    args = parser.parse_args()
+
+    for file_count in args.files:
+        spec = LibrarySpec(
+            files=file_count,
+            depth=args.depth,
+            fanout=args.fanout,
+            collision_ratio=args.collisions,
+            hardlink_ratio=args.hardlinks,
+            files_per_torrent=args.files_per_torrent,
+        )
+        results = bench_library(spec, args.workers, quiet=not args.verbose)
+        if args.json:
+            print(json.dumps(results))
+            continue
+        print(f"\n{file_count} files, {results['torrents']} torrents")
+        for key, value in results.items():
+            if key not in ("files", "torrents"):
+                print(f"  {key:<22} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Times one invocation of the script per torrent, the way qBittorrent's "Run external program" hook calls it.
+
+    python benchmarks/bench_startup.py --runs 10
+
+Reports the time to import the script, and the wall time of whole runs for a single, already matched
+torrent against an in-process fake Web API: the first run logs in, later runs reuse the saved session.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_qbittorrent import FakeQbittorrent  # noqa: E402
+
+SCRIPT = Path(__file__).resolve().parent.parent / "qbittorrent_file_matcher.py"
+
+
+def time_command(command: list[str], cwd: Path) -> float:
+    start = time.perf_counter()
+    subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def summary(times: list[float]) -> str:
+    return f"median {statistics.median(times) * 1000:7.1f} ms, min {min(times) * 1000:7.1f} ms"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks per-invocation startup overhead")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="qfm-startup-") as tmp, FakeQbittorrent() as fake:
+        root = Path(tmp)
+        content = root / "library" / "Torrent"
+        content.mkdir(parents=True)
+        with (content / "file.bin").open("wb") as f:
+            f.truncate(1 << 20)
+        torrent_hash = hashlib.sha1(b"startup").hexdigest()
+        fake.add_torrent(
+            {"hash": torrent_hash, "name": "Torrent", "save_path": str(root / "library"), "content_path": str(content)},
+            [{"name": "Torrent/file.bin", "size": 1 << 20, "priority": 1, "progress": 1, "piece_range": [0, 0]}],
+        )
+        workdir = root / "workdir"
+        workdir.mkdir()
+        (workdir / "client.ini").write_text(f"[Client]\nhost = {fake.host}\nusername = admin\npassword = adminadmin\n")
+
+        imports = [
+            time_command([sys.executable, "-c", "import qbittorrent_file_matcher"], SCRIPT.parent)
+            for _ in range(args.runs)
+        ]
+        command = [sys.executable, str(SCRIPT), torrent_hash, "--no-index"]
+        cold = []
+        for _ in range(args.runs):
+            (workdir / "session.json").unlink(missing_ok=True)
+            cold.append(time_command(command, workdir))
+        fake.reset_counters()
+        warm = [time_command(command, workdir) for _ in range(args.runs)]
+        warm_logins = fake.logins
+
+    interpreter = [time_command([sys.executable, "-c", "pass"], SCRIPT.parent) for _ in range(args.runs)]
+    print(f"python itself      {summary(interpreter)}")
+    print(f"import             {summary(imports)}")
+    print(f"run, logging in    {summary(cold)}")
+    print(f"run, saved session {summary(warm)} ({warm_logins} logins in {args.runs} runs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""In-process stand-in for the parts of the qBittorrent Web API the matcher talks to.
+
+It keeps torrents in memory, counts requests and bytes per endpoint and behaves like the real thing
+where the matcher cares: requests without a valid SID cookie get a 403, renames onto an existing
+name get a 409, torrents/info honours the hashes, sort, limit and offset parameters, sync/maindata only
+returns the torrents changed since the rid it is given and a recheck keeps a torrent in checkingUP
+for recheck_seconds.
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+SID = "benchmark-sid"
+
+
+class FakeQbittorrent:
+    """Serves the fake Web API on 127.0.0.1 from a background thread."""
+
+    def __init__(self, app_version: str = "v4.6.0", web_api_version: str = "2.9.3", recheck_seconds: float = 0.0):
+        self.app_version = app_version
+        self.web_api_version = web_api_version
+        self.recheck_seconds = recheck_seconds
+        self.rechecks: list[list[str]] = []  # The hashes of every torrents/recheck call.
+        self.torrents: dict[str, dict[str, Any]] = {}  # lowercase hash -> {"info": {...}, "files": [...]}
+        self.requests: Counter[str] = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.logins = 0
+        self.revision = 0  # Bumped by every add_torrent()/set_state(), sync/maindata's rid.
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+
+    @property
+    def host(self) -> str:
+        assert self._server, "server not started"
+        return f"127.0.0.1:{self._server.server_port}"
+
+    def add_torrent(self, info: dict[str, Any], files: list[dict[str, Any]]) -> None:
+        info.setdefault("state", "stalledUP")
+        with self._lock:
+            self.revision += 1
+            self.torrents[info["hash"].lower()] = {"info": info, "files": files, "revision": self.revision}
+
+    def set_state(self, torrent_hash: str, state: str) -> None:
+        with self._lock:
+            self.revision += 1
+            torrent = self.torrents[torrent_hash.lower()]
+            torrent["info"]["state"] = state
+            torrent["revision"] = self.revision
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.bytes_sent = self.bytes_received = self.logins = 0
+
+    def start(self) -> FakeQbittorrent:
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-qbittorrent", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> FakeQbittorrent:
+        return self.start()
+
+    def __exit__(self, *_: object) -> None:
+        self.stop()
+
+    def handle(self, endpoint: str, params: dict[str, str], cookies: dict[str, str]) -> tuple[int, Any, dict[str, str]]:
+        """Returns (status, body, extra headers) for one request."""
+        if endpoint == "auth/login":
+            self.logins += 1
+            return 200, "Ok.", {"Set-Cookie": f"SID={SID}; HttpOnly; path=/"}
+        if cookies.get("SID") != SID:
+            return 403, "Forbidden", {}
+
+        if endpoint == "app/version":
+            return 200, self.app_version, {}
+        if endpoint == "app/webapiVersion":
+            return 200, self.web_api_version, {}
+        if endpoint == "torrents/info":
+            return 200, self._info(params), {}
+        if endpoint == "sync/maindata":
+            return 200, self._maindata(int(params.get("rid") or 0)), {}
+
+        torrent = self.torrents.get(params.get("hash", "").lower())
+        if endpoint in ("torrents/setLocation", "torrents/recheck"):
+            hashes = params.get("hashes", "").lower().split("|")
+            if not all(h in self.torrents for h in hashes):
+                return 404, "Not Found", {}
+            if endpoint == "torrents/recheck":
+                self._recheck(hashes)
+            return 200, "", {}
+        if torrent is None:
+            return 404, "Not Found", {}
+        if endpoint == "torrents/files":
+            return 200, [dict(file, index=index) for index, file in enumerate(torrent["files"])], {}
+        if endpoint == "torrents/renameFile":
+            return self._rename(torrent, params)
+        if endpoint == "torrents/filePrio":
+            for file_id in params["id"].split("|"):
+                torrent["files"][int(file_id)]["priority"] = int(params["priority"])
+            return 200, "", {}
+        return 404, "Not Found", {}
+
+    def _recheck(self, hashes: list[str]) -> None:
+        self.rechecks.append(hashes)
+        for torrent_hash in hashes:
+            torrent = self.torrents[torrent_hash]
+            torrent.setdefault("state_after_check", torrent["info"]["state"])
+            torrent["checking_since"] = time.monotonic()
+            torrent["info"]["state"] = "checkingUP"
+
+    def _info(self, params: dict[str, str]) -> list[dict[str, Any]]:
+        now = time.monotonic()
+        for torrent in self.torrents.values():
+            if "checking_since" not in torrent:
+                continue
+            elapsed = now - torrent["checking_since"]
+            if elapsed >= self.recheck_seconds:
+                torrent.pop("checking_since")
+                torrent["info"]["state"] = torrent.pop("state_after_check")
+                torrent["info"]["progress"] = 1
+            else:
+                torrent["info"]["progress"] = elapsed / self.recheck_seconds
+        if params.get("hashes"):
+            wanted = params["hashes"].lower().split("|")
+            items = [self.torrents[h]["info"] for h in wanted if h in self.torrents]
+        else:
+            items = [torrent["info"] for torrent in self.torrents.values()]
+        if params.get("sort"):
+            items = sorted(items, key=lambda info: info.get(params["sort"], 0))
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 0)
+        return items[offset:offset + limit] if limit else items[offset:]
+
+    def _maindata(self, rid: int) -> dict[str, Any]:
+        changed = {
+            torrent_hash: dict(torrent["info"])
+            for torrent_hash, torrent in self.torrents.items()
+            if torrent["revision"] > rid
+        }
+        return {"rid": self.revision, "full_update": rid == 0, "torrents": changed}
+
+    @staticmethod
+    def _rename(torrent: dict[str, Any], params: dict[str, str]) -> tuple[int, Any, dict[str, str]]:
+        files = torrent["files"]
+        if "oldPath" in params:
+            old_path, new_path = params["oldPath"], params["newPath"]
+        else:
+            old_path, new_path = files[int(params["id"])]["name"], params["name"]
+        names = {file["name"] for file in files}
+        if new_path in names or old_path not in names:
+            return 409, "Conflict", {}
+        for file in files:
+            if file["name"] == old_path:
+                file["name"] = new_path
+        return 200, "", {}
+
+
+def _make_handler(fake: FakeQbittorrent) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real Web UI
+        disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+        def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=W0622
+            pass
+
+        def do_GET(self) -> None:
+            self._dispatch(b"")
+
+        def do_POST(self) -> None:
+            self._dispatch(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+
+        def _dispatch(self, body: bytes) -> None:
+            url = urllib.parse.urlparse(self.path)
+            params = dict(urllib.parse.parse_qsl(url.query))
+            params.update(urllib.parse.parse_qsl(body.decode()))
+            cookie_header = self.headers.get("Cookie", "")
+            cookies = dict(part.strip().split("=", 1) for part in cookie_header.split(";") if "=" in part)
+            endpoint = url.path.split("/api/v2/", 1)[-1]
+
+            with fake._lock:  # pylint: disable=W0212
+                fake.requests[endpoint] += 1
+                fake.bytes_received += len(body)
+                status, payload, headers = fake.handle(endpoint, params, cookies)
+
+            if isinstance(payload, str):
+                data, content_type = payload.encode(), "text/plain; charset=UTF-8"
+            else:
+                data, content_type = json.dumps(payload).encode(), "application/json"
+            with fake._lock:  # pylint: disable=W0212
+                fake.bytes_sent += len(data)
+
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
@@ -0,0 +1,95 @@
+"""Builds synthetic download libraries and the torrents that should match them.
+
+Files are created sparse (truncated to size, never written), so even a million of them take little
+real disk space. A share of the files can be given the size of an earlier file (size collisions, which
+lead to multiple matches) or created as hardlinks of an earlier file.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import random
+from pathlib import Path
+from typing import Any, NamedTuple
+
+
+class LibrarySpec(NamedTuple):
+    files: int = 10_000
+    depth: int = 3
+    fanout: int = 8  # subdirectories per directory
+    collision_ratio: float = 0.02
+    hardlink_ratio: float = 0.01
+    files_per_torrent: int = 20
+    seed: int = 1
+
+
+class SyntheticTorrent(NamedTuple):
+    info: dict[str, Any]
+    files: list[dict[str, Any]]
+
+
+def _leaf_dirs(root: Path, depth: int, fanout: int) -> list[Path]:
+    dirs = [root]
+    for level in range(depth):
+        dirs = [parent / f"d{level}_{i}" for parent in dirs for i in range(fanout)]
+    return dirs
+
+
+def build_library(root: Path, spec: LibrarySpec) -> list[SyntheticTorrent]:
+    """Fills root/library with spec.files files and returns torrents whose files were renamed since.
+
+    Each torrent holds spec.files_per_torrent files of one leaf directory, under its original names,
+    so the matcher has to find and rename every one of them.
+    """
+    rng = random.Random(spec.seed)
+    library = root / "library"
+    leaf_dirs = _leaf_dirs(library, spec.depth, spec.fanout)
+    for leaf in leaf_dirs:
+        leaf.mkdir(parents=True, exist_ok=True)
+
+    sizes: list[int] = []
+    paths: list[Path] = []
+    for i in range(spec.files):
+        path = leaf_dirs[(i // spec.files_per_torrent) % len(leaf_dirs)] / f"renamed_{i:07d}.bin"
+        roll = rng.random()
+        if paths and roll < spec.hardlink_ratio:
+            source = rng.randrange(len(paths))
+            os.link(paths[source], path)
+            size = sizes[source]
+        else:
+            if sizes and roll < spec.hardlink_ratio + spec.collision_ratio:
+                size = sizes[rng.randrange(len(sizes))]
+            else:
+                size = rng.randrange(1 << 20, 1 << 32)
+            with path.open("wb") as f:
+                f.truncate(size)
+        sizes.append(size)
+        paths.append(path)
+
+    torrents: list[SyntheticTorrent] = []
+    for first in range(0, spec.files, spec.files_per_torrent):
+        chunk = range(first, min(first + spec.files_per_torrent, spec.files))
+        name = f"Torrent {first // spec.files_per_torrent:06d}"
+        torrent_hash = hashlib.sha1(name.encode()).hexdigest()
+        files = [
+            {
+                "name": f"{name}/original_{i:07d}.bin",
+                "size": sizes[i],
+                "priority": 1,
+                "progress": 0,
+                "piece_range": [0, 0],
+                "availability": 0,
+                "is_seed": False,
+            }
+            for i in chunk
+        ]
+        info = {
+            "hash": torrent_hash,
+            "name": name,
+            "save_path": str(library),
+            "content_path": str(library / name),  # doesn't exist, so the whole library is searched
+            "state": "missingFiles",
+            "size": sum(file["size"] for file in files),
+        }
+        torrents.append(SyntheticTorrent(info, files))
+    return torrents
@@ -1,12 +1,30 @@
 from __future__ import annotations
 
 import argparse
+import bisect
 import configparser
+import contextlib
+import cProfile
+import difflib
+import hashlib
+import importlib.util
+import io
+import json
 import os
+import queue
+import select
+import sqlite3
+import stat
+import struct
 import sys
+import threading
+import time
 import traceback
+import zlib
+from array import array
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 from pathlib import Path, PurePath
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, NamedTuple, TextIO
 
 if os.name == "nt":
     import ctypes
@@ -17,8 +35,9 @@ if sys.version_info < (3, 7, 0):
 
 try:  # sourcery skip: remove-redundant-exception, simplify-single-exception-tuple
     from colorama import Fore, Style, init
-    from InquirerPy.resolver import prompt
-    from qbittorrentapi import Client, Conflict409Error, TorrentDictionary, TorrentFile
+    from qbittorrentapi import APIConnectionError, Client, Conflict409Error, TorrentDictionary, TorrentFile
+    if importlib.util.find_spec("InquirerPy") is None:  # Imported by prompt() on first use, but checked up front.
+        raise ModuleNotFoundError("No module named 'InquirerPy'")
 except (ImportError, ModuleNotFoundError):
     print(traceback.format_exc())
     print("You need to install the dependencies.")
@@ -78,9 +97,92 @@ def make_new_config(
         config.write(f)
     print("client.ini created")
 
+_inquirer_prompt: Callable | None = None
+
+def prompt(questions: list[dict[str, Any]]) -> dict[Any, Any]:
+    """InquirerPy's prompt, imported on first use. It takes longer to import than most runs take to match."""
+    global _inquirer_prompt  # pylint: disable=W0603
+    if _inquirer_prompt is None:
+        try:
+            from InquirerPy.resolver import prompt as inquirer_prompt  # pylint: disable=C0415
+        except (ImportError, ModuleNotFoundError):
+            print(traceback.format_exc())
+            print("You need to install the dependencies.")
+            print("If you have pip (normally installed with python), run this command in a terminal (cmd):")
+            print("pip install colorama inquirerpy qbittorrent-api")
+            sys.exit()
+        _inquirer_prompt = inquirer_prompt
+    return _inquirer_prompt(questions)
+
+SESSION_FILE = "session.json"  # Web UI session cookie of the last login, next to client.ini.
+LOGIN_PATH = "api/v2/auth/login"
+
+def load_session(host: str, username: str) -> dict[str, str] | None:
+    """The session an earlier run logged in with, if it was for the same host and user."""
+    try:
+        with open(SESSION_FILE, encoding="utf-8") as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if session.get("host") != host or session.get("username") != username:
+        return None
+    return session
+
+def save_session(host: str, username: str) -> Callable:
+    """Response hook storing the session cookie of every successful login, readable by the owner only."""
+    def hook(response: Any, *_: Any, **__: Any) -> None:
+        if not response.ok or LOGIN_PATH not in response.url:
+            return
+        cookie = next((c for c in response.cookies if c.name == "SID" or c.name.startswith("QBT_SID_")), None)
+        if cookie is None:
+            return
+        session = {
+            "host": host,
+            "username": username,
+            "base_url": response.url.split(LOGIN_PATH)[0],  # Scheme included, so it needn't be detected again.
+            "cookie": cookie.name,
+            "value": cookie.value,
+        }
+        try:
+            fd = os.open(SESSION_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            if hasattr(os, "fchmod"):  # The mode above only applies to a new file. Windows has neither.
+                os.fchmod(fd, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(session, f)
+        except OSError as e:
+            print(f"{Fore.YELLOW}Warning: could not save the session to '{SESSION_FILE}': {e}{Style.RESET_ALL}")
+    return hook
+
 def init_client() -> Client:
+    """A client that reuses the session of an earlier run, so a run doesn't start with a login.
+
+    If the saved session expired, the first request gets a 403 and qbittorrentapi logs in by itself.
+    Setting the cookie relies on qbittorrentapi internals, if they changed the session is ignored.
+    """
     host, username, password = get_config()
-    return Client(host=host, username=username, password=password)
+    session: dict[str, str] | None = load_session(host, username)
+
+    def new_client(base_url: str | None) -> Client:
+        return Client(
+            host=base_url or host,
+            username=username,
+            password=password,
+            FORCE_SCHEME_FROM_HOST=base_url is not None,
+            HTTPADAPTER_ARGS={"pool_connections": API_CONCURRENCY, "pool_maxsize": API_CONCURRENCY},
+            REQUESTS_ARGS={"hooks": {"response": [PROFILER.on_response, save_session(host, username)]}},
+        )
+
+    if not session:
+        return new_client(None)
+    qb_client = new_client(session["base_url"])
+    try:
+        # Building the URL starts a new HTTP session, so it has to happen before the cookie is set.
+        qb_client._url.build_base_url({}, {})  # pylint: disable=W0212
+        qb_client._session.cookies.set(session["cookie"], session["value"])  # pylint: disable=W0212
+    except Exception as e:  # pylint: disable=W0718
+        print(f"{Fore.YELLOW}Warning: could not reuse the saved session, logging in: {e}{Style.RESET_ALL}")
+        return new_client(None)
+    return qb_client
 
 def windows_get_size_on_disk(file_path: os.PathLike | str) -> int:
     # Define GetCompressedFileSizeW from the Windows API
@@ -112,53 +214,64 @@ def get_size_on_disk(file_path: os.PathLike | str):
 
     return windows_get_size_on_disk(file_path)
 
-# From stackoverflow.
-def are_all_paths_same(
-    paths: list[os.PathLike | str] | list[str] | list[os.PathLike],
-) -> bool:
-    # sourcery skip: assign-if-exp, hoist-statement-from-if, remove-redundant-condition
-    file_identifiers = set()
-    for path in paths:
-        try:
-            resolved_path: Path = Path(path).resolve(strict=True)
-            file_stat = os.stat(resolved_path, follow_symlinks=True)
-            file_identifier: tuple[int, int] = (file_stat.st_dev, file_stat.st_ino)
-            file_identifiers.add(file_identifier)
-        except FileNotFoundError:
-            # Handle the case where the path does not exist
-            print(f"{Fore.YELLOW}Warning: The path '{path}' was not found.")
-            return False
-
-    # If all paths refer to the same device and inode/file index, the set will contain only one unique identifier
-    return len(file_identifiers) == 1
-
 def hardlink_largest_file(
     matching_files: list[str] | list[Path | str] | list[Path],
+    known_files: dict[str, Candidate] | None = None,
+    own_file: os.PathLike | str | None = None,
 ):
-    """Find the largest file by 'size on disk' among matching_files and hardlink it."""
-    existing_files: set[Path] = {Path(file).resolve() for file in matching_files if Path(file).resolve().exists()}
+    """Find the largest file by 'size on disk' among matching_files and hardlink it.
+
+    Only files with identical content are linked together, as found by CONTENT_DIGESTS, so a mere size
+    collision never costs a file. own_file, the torrent's own copy, is created as a hardlink of the largest
+    file if it doesn't exist, but an existing one is replaced only if its content is identical too.
+    known_files holds what the scan already knows about some of the files, so they aren't stat'ed again.
+    """
+    known_files = known_files or {}
+    resolved_files: list[tuple[os.PathLike | str, str]] = [(file, os.path.realpath(file)) for file in matching_files]
+    existing_files: dict[str, Candidate] = {}
+    for file, resolved_path in resolved_files:
+        candidate: Candidate | None = known_files.get(str(file))
+        if candidate is None:
+            try:
+                candidate = stat_candidate(resolved_path)
+            except FileNotFoundError:
+                continue
+        existing_files[resolved_path] = candidate
     if not existing_files:
         print("No files exist on disk to hardlink!")
         return
-    largest_file: Path = max(existing_files, key=get_size_on_disk)
-    if not largest_file.exists():
-        return
-    for file in matching_files:
-        r_file = Path(file).resolve()
-        if r_file == largest_file:
+    own_path: str | None = os.path.realpath(own_file) if own_file is not None else None
+    largest_file, largest = max(existing_files.items(), key=lambda item: item[1].size_on_disk)
+
+    link_to: dict[str, str] = {}  # resolved path -> the file it becomes a hardlink of
+    for group in CONTENT_DIGESTS.identical_groups(list(existing_files)):
+        source: str = max(group, key=lambda path: existing_files[path].size_on_disk)
+        for path in group:
+            if existing_files[path].file_id != existing_files[source].file_id:
+                link_to[path] = source
+    if own_path is not None and own_path not in existing_files:
+        link_to[own_path] = largest_file
+
+    for file, resolved_path in resolved_files:
+        source = link_to.pop(resolved_path, None)
+        if source is None:
+            candidate = existing_files.get(resolved_path)
+            if candidate is not None and candidate.file_id != largest.file_id:
+                print(f"{Fore.YELLOW}'{file}' differs from '{largest_file}', left as is{Style.RESET_ALL}")
             continue
 
-        r_file.parent.mkdir(exist_ok=True, parents=True)
-        if r_file.exists() and r_file.is_dir():  # unlink will fail if it's somehow a folder.
+        Path(resolved_path).parent.mkdir(exist_ok=True, parents=True)
+        if os.path.isdir(resolved_path):  # unlink will fail if it's somehow a folder.
             print(f"'{file}' is somehow a directory, rmdir()")
-            r_file.rmdir()
+            os.rmdir(resolved_path)
         else:
             print(f"Deleting file '{file}'")
-            r_file.unlink(missing_ok=True)
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(resolved_path)
 
         # Create hardlink
-        print(f"Creating hardlink for '{largest_file}' <-> '{file}'")
-        os.link(largest_file, r_file)
+        print(f"Creating hardlink for '{source}' <-> '{file}'")
+        os.link(source, resolved_path)
 
 def is_relative_to(path1: Path, path2: Path) -> bool:
     """pathlib.Path in later versions of python already have this builtin"""
@@ -169,71 +282,1683 @@ def is_relative_to(path1: Path, path2: Path) -> bool:
     else:
         return True
 
+class _Phase:
+    """Context manager adding the wall time of its block to a phase, see Profiler.phase()."""
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *_: object) -> None:
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+
+
+class Profiler:
+    """Wall time per phase and counters, per torrent and per scanned root, for --profile.
+
+    Times and counts always go into the run totals, and also into the record (torrent or scan)
+    the current thread is working on, if any. Does nothing until start() is called.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.output: TextIO | None = None
+        self.totals: dict[str, float] = {}
+        self.torrent_times: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._noop = contextlib.nullcontext()
+
+    def start(self, output_file: Path | None = None) -> None:
+        """Enables profiling. Records are written to output_file as JSON lines, or summarized on stdout at the end."""
+        self.enabled = True
+        self.output = output_file.open("w", encoding="utf-8") if output_file else None
+
+    def _current(self) -> dict[str, Any] | None:
+        return getattr(self._local, "record", None)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.count(f"{name}_seconds", seconds)
+
+    def phase(self, name: str) -> contextlib.AbstractContextManager:
+        return _Phase(self, name) if self.enabled else self._noop
+
+    def count(self, name: str, amount: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.totals[name] = self.totals.get(name, 0) + amount
+            record = self._current()
+            if record is not None:
+                record[name] = record.get(name, 0) + amount
+
+    @contextlib.contextmanager
+    def record(self, kind: str, **fields: Any) -> Iterator[None]:
+        """Collects everything the current thread does in the block into one record."""
+        if not self.enabled:
+            yield
+            return
+        record: dict[str, Any] = {"type": kind, **fields}
+        previous, self._local.record = self._current(), record
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.record = previous
+            record["wall_seconds"] = time.perf_counter() - start
+            if kind == "torrent":
+                self.torrent_times.append((record["wall_seconds"], str(fields.get("name"))))
+            self._emit(record)
+
+    def wrap(self, function: Callable) -> Callable:
+        """Makes function count into the caller's record when it runs in another thread."""
+        if not self.enabled:
+            return function
+        record = self._current()
+
+        def bound(*args: Any, **kwargs: Any) -> Any:
+            previous, self._local.record = self._current(), record
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.record = previous
+
+        return bound
+
+    def on_response(self, response: Any, *_: Any, **__: Any) -> None:
+        """requests response hook, counts every Web API request and the bytes both ways."""
+        if not self.enabled:
+            return
+        self.count("api_requests")
+        self.count("api_bytes_received", len(response.content))
+        body = response.request.body
+        self.count("api_bytes_sent", len(body) if body else 0)
+
+    def _emit(self, record: dict[str, Any]) -> None:
+        if self.output:
+            with self._lock:
+                rounded = {key: round(value, 6) if isinstance(value, float) else value for key, value in record.items()}
+                self.output.write(json.dumps(rounded, default=str) + "\n")
+
+    def finish(self) -> None:
+        if not self.enabled:
+            return
+        summary = {"type": "summary", **self.totals}
+        if self.output:
+            self._emit(summary)
+            self.output.close()
+            return
+        print(f"\n{'Profile':<28}{'total':>14}")
+        for name, value in sorted(self.totals.items()):
+            print(f"{name:<28}{value:>14.3f}" if name.endswith("_seconds") else f"{name:<28}{int(value):>14}")
+        if self.torrent_times:
+            print("\nSlowest torrents:")
+            for seconds, name in sorted(self.torrent_times, reverse=True)[:10]:
+                print(f"{seconds:>10.3f}s  {name}")
+
+
+PROFILER = Profiler()
+
+
+class PieceVerifier:
+    """Tells same-size candidates apart using the torrent's v1 piece hashes.
+
+    Only pieces lying entirely inside a file can be checked against it, so a file smaller than a piece
+    (or one straddling two pieces) can't be verified and is left to the usual prompt. So is every file of
+    a v2-only torrent, whose piece hashes aren't SHA-1.
+    """
+
+    def __init__(self, torrent: TorrentDictionary, torrent_files: list[TorrentFile], workers: int = 4):
+        self.torrent = torrent
+        self.torrent_files = torrent_files
+        self.workers = workers
+        self._piece_size: int = 0
+        self._piece_hashes: list[bytes] = []
+        self._file_offsets: dict[int, int] = {}
+        self._total_length: int = 0
+        self._loaded = False
+
+    def _load(self) -> None:
+        """Fetches piece hashes and works out where each file starts, on first use only."""
+        if self._loaded:
+            return
+        self._loaded = True
+        self._piece_size = int(self.torrent.properties.piece_size)
+        self._piece_hashes = [bytes.fromhex(piece_hash) for piece_hash in self.torrent.piece_hashes]
+        if any(len(piece_hash) != hashlib.sha1().digest_size for piece_hash in self._piece_hashes):
+            print(f"{Fore.YELLOW}'{self.torrent.name}' has no v1 piece hashes, its files can't be verified{Style.RESET_ALL}")
+            self._piece_hashes = []
+
+        offset = 0
+        for torrent_file in sorted(self.torrent_files, key=lambda file: int(file.index)):
+            piece_range = torrent_file.get("piece_range")
+            if torrent_file.size and piece_range and offset // self._piece_size != piece_range[0]:
+                # Padding files (BEP 47) are hidden from the file list, they push the next file to a piece boundary.
+                offset = piece_range[0] * self._piece_size
+            self._file_offsets[int(torrent_file.index)] = offset
+            offset += int(torrent_file.size)
+        self._total_length = offset
+
+    def _pieces_inside(self, torrent_file: TorrentFile) -> list[tuple[int, int, int]]:
+        """(piece index, offset in file, length) of every piece lying entirely inside torrent_file."""
+        start = self._file_offsets[int(torrent_file.index)]
+        end = start + int(torrent_file.size)
+        first_piece = -(-start // self._piece_size)  # ceil
+        pieces = []
+        for piece_index in range(first_piece, len(self._piece_hashes)):
+            piece_start = piece_index * self._piece_size
+            piece_end = min(piece_start + self._piece_size, self._total_length)
+            if piece_end > end:
+                break
+            pieces.append((piece_index, piece_start - start, piece_end - piece_start))
+        return pieces
+
+    def _check(self, path: str, pieces: list[tuple[int, int, int]]) -> bool:
+        """Hashes the pieces in one sequential pass, stopping at the first mismatch."""
+        buffer = bytearray(self._piece_size)
+        view = memoryview(buffer)
+        try:
+            with open(path, "rb", buffering=0) as f:
+                f.seek(pieces[0][1])
+                for piece_index, _, length in pieces:
+                    if f.readinto(view[:length]) != length:
+                        return False
+                    if hashlib.sha1(view[:length]).digest() != self._piece_hashes[piece_index]:
+                        return False
+        except OSError as e:
+            print(f"{Fore.YELLOW}Warning: could not verify '{path}': {e}{Style.RESET_ALL}")
+            return False
+        return True
+
+    def check(self, torrent_file: TorrentFile, path: str) -> bool | None:
+        """Whether path holds torrent_file's data, or None if no piece lies entirely inside the file."""
+        self._load()
+        pieces = self._pieces_inside(torrent_file)
+        return self._check(path, pieces) if pieces else None
+
+    def narrow(self, torrent_file: TorrentFile, candidates: list[str]) -> list[str]:
+        """Returns the candidates whose content matches the torrent's pieces, or all of them if none can be checked or match."""
+        self._load()
+        pieces = self._pieces_inside(torrent_file)
+        if not pieces:
+            return candidates
+        print(f"Verifying {len(candidates)} candidates for '{torrent_file.name}' against {len(pieces)} piece hashes")
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(candidates))) as pool:
+            results = list(pool.map(lambda path: self._check(path, pieces), candidates))
+        verified = [path for path, ok in zip(candidates, results) if ok]
+        if not verified:
+            # Not proof the file is missing (the torrent may be partly downloaded), so it's left to choose from all.
+            print(f"{Fore.YELLOW}None of the candidates match the piece hashes of '{torrent_file.name}', keeping them all{Style.RESET_ALL}")
+            return candidates
+        return verified
+
+
+EDGE_BYTES = 64 * 1024  # Read from each end of a file for the cheap digest.
+HASH_BUFFER_BYTES = 1024 * 1024
+
+
+def edge_digest(path: str, size: int) -> bytes:
+    """Digest of the first and last EDGE_BYTES of a file, enough to tell most same-size files apart."""
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        digest.update(f.read(EDGE_BYTES))
+        if size > EDGE_BYTES:
+            f.seek(max(EDGE_BYTES, size - EDGE_BYTES))
+            digest.update(f.read(EDGE_BYTES))
+    return digest.digest()
+
+
+def full_digest(path: str) -> bytes:
+    """Digest of the whole file. Module level so it can run in a worker process."""
+    digest = hashlib.blake2b()
+    view = memoryview(bytearray(HASH_BUFFER_BYTES))
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            read = f.readinto(view)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.digest()
+
+
+class ContentDigests:
+    """Finds which files have identical content, reading as little of them as possible.
+
+    Files are grouped by size, then by a digest of their first and last 64 KiB, and only files still
+    sharing a group get a full hash, spread over a process pool. Digests are cached by
+    (dev, inode, mtime, size), in the scan index when there is one, so reruns don't read files again.
+    """
+
+    def __init__(self, workers: int = 4):
+        self.workers = workers
+        self.scan_index: ScanIndex | None = None
+        self._memory: dict[tuple[int, int, int, int, str], bytes] = {}
+
+    def _cached(self, key: tuple[int, int, int, int], kind: str) -> bytes | None:
+        digest = self._memory.get((*key, kind))
+        if digest is None and self.scan_index:
+            digest = self.scan_index.get_digest(key, kind)
+        return digest
+
+    def _store(self, key: tuple[int, int, int, int], kind: str, digest: bytes) -> None:
+        self._memory[(*key, kind)] = digest
+        if self.scan_index:
+            self.scan_index.put_digest(key, kind, digest)
+
+    def _split(self, paths: list[str], keys: dict[str, tuple[int, int, int, int]], kind: str) -> list[list[str]]:
+        """Splits paths by their digest of the given kind, hashing each file (not each link to it) once."""
+        digests: dict[tuple[int, int, int, int], bytes | None] = {keys[path]: None for path in paths}
+        to_hash: dict[tuple[int, int, int, int], str] = {}
+        for path in paths:
+            key = keys[path]
+            if digests[key] is None and key not in to_hash:
+                cached = self._cached(key, kind)
+                if cached is None:
+                    to_hash[key] = path
+                digests[key] = cached
+
+        if kind == "edge" or len(to_hash) <= 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                hashed = pool.map(lambda path: self._hash(path, kind, keys[path][3]), to_hash.values())
+                results = list(hashed)
+        else:
+            from concurrent.futures import ProcessPoolExecutor  # pylint: disable=C0415  # Pulls in multiprocessing.
+
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(to_hash))) as pool:
+                results = list(pool.map(_try_full_digest, to_hash.values()))
+        PROFILER.count(f"{kind}_digests", len(to_hash))
+        for key, digest in zip(to_hash, results):
+            if digest is not None:
+                digests[key] = digest
+                self._store(key, kind, digest)
+
+        groups: dict[bytes, list[str]] = {}
+        for path in paths:
+            digest = digests[keys[path]]
+            if digest is not None:  # Unreadable files are never considered identical to anything.
+                groups.setdefault(digest, []).append(path)
+        return list(groups.values())
+
+    @staticmethod
+    def _hash(path: str, kind: str, size: int) -> bytes | None:
+        if kind == "full":
+            return _try_full_digest(path)
+        try:
+            return edge_digest(path, size)
+        except OSError as e:
+            print(f"{Fore.YELLOW}Warning: could not read '{path}': {e}{Style.RESET_ALL}")
+            return None
+
+    def identical_groups(self, paths: list[str]) -> list[list[str]]:
+        """Partitions paths into groups of files with identical content. Unreadable files are left out."""
+        keys: dict[str, tuple[int, int, int, int]] = {}
+        by_size: dict[int, list[str]] = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                print(f"{Fore.YELLOW}Warning: could not stat '{path}': {e}{Style.RESET_ALL}")
+                continue
+            keys[path] = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+            by_size.setdefault(st.st_size, []).append(path)
+
+        def distinct(group: list[str]) -> int:
+            return len({keys[path][:2] for path in group})
+
+        groups: list[list[str]] = []
+        for size, same_size in by_size.items():
+            if distinct(same_size) == 1:
+                groups.append(same_size)
+                continue
+            for same_edges in self._split(same_size, keys, "edge"):
+                if distinct(same_edges) == 1 or size <= 2 * EDGE_BYTES:  # The edges were the whole file.
+                    groups.append(same_edges)
+                    continue
+                groups.extend(self._split(same_edges, keys, "full"))
+        return groups
+
+
+def _try_full_digest(path: str) -> bytes | None:
+    try:
+        return full_digest(path)
+    except OSError as e:
+        print(f"{Fore.YELLOW}Warning: could not read '{path}': {e}{Style.RESET_ALL}")
+        return None
+
+
+CONTENT_DIGESTS = ContentDigests()
+
+
+class TorrentFileCache:
+    """Torrent file lists kept in the scan index between runs, keyed by infohash.
+
+    Sizes, indexes and piece ranges never change for an infohash, names and priorities do. An entry
+    is only used while the torrent's name, save path, content path and selected size (which follows the
+    priorities) are what they were when it was stored, and is dropped when a file of the torrent is
+    renamed. A file renamed in qBittorrent is moved on disk as well, so the stale name no longer
+    points at a file, and files_in_place() sends the torrent for a fresh list. Only the matcher reads
+    entries, -find shows names without checking them against the disk and always fetches.
+    """
+
+    FIELDS = ("index", "id", "name", "size", "priority", "piece_range")
+
+    def __init__(self):
+        self.scan_index: ScanIndex | None = None
+
+    @staticmethod
+    def signature(torrent: TorrentDictionary) -> str:
+        return json.dumps([torrent.get(field) for field in ("name", "save_path", "content_path", "size")])
+
+    def get(self, torrent: TorrentDictionary) -> list[TorrentFile] | None:
+        if self.scan_index is None:
+            return None
+        files = self.scan_index.get_file_list(torrent.hash.upper(), self.signature(torrent))
+        return None if files is None else [TorrentFile(file) for file in files]
+
+    def put(self, torrent: TorrentDictionary, files: list[TorrentFile]) -> None:
+        if self.scan_index is not None:
+            stored = [{field: file.get(field) for field in self.FIELDS} for file in files]
+            self.scan_index.put_file_list(torrent.hash.upper(), self.signature(torrent), stored)
+
+    def forget(self, torrent_hash: str) -> None:
+        if self.scan_index is not None:
+            self.scan_index.forget_file_list(torrent_hash.upper())
+
+
+TORRENT_FILE_CACHE = TorrentFileCache()
+
+
+class DiskFile(NamedTuple):
+    """A file found while scanning, with the stat fields we keep around."""
+    path: str
+    size: int
+    mtime_ns: int
+    dev: int
+    ino: int
+    blocks: int  # st_blocks, -1 where the platform doesn't report it.
+
+
+class Candidate(NamedTuple):
+    """A disk file that may be a torrent file, carrying the identity and allocation the scan saw."""
+    path: str
+    dev: int
+    ino: int
+    blocks: int
+
+    @property
+    def file_id(self) -> tuple[int, int | str]:
+        """Equal for hard/symlinks of the same file. Without an inode (0) every path counts as its own file."""
+        return (self.dev, self.ino) if self.ino else (-1, self.path)
+
+    @property
+    def size_on_disk(self) -> int:
+        if self.blocks >= 0:
+            return self.blocks * 512  # st_blocks are 512-byte blocks
+        return get_size_on_disk(self.path)
+
+
+def stat_candidate(path: str) -> Candidate:
+    st = os.stat(path)
+    return Candidate(path, st.st_dev, st.st_ino, getattr(st, "st_blocks", -1))
+
+
+def distinct_files(candidates: list[Candidate]) -> list[Candidate]:
+    """Collapses hard/symlinked copies into one candidate each, keeping the first path in sort order."""
+    by_file_id: dict[tuple[int, int | str], Candidate] = {}
+    for candidate in candidates:
+        kept = by_file_id.get(candidate.file_id)
+        if kept is None or candidate.path < kept.path:
+            by_file_id[candidate.file_id] = candidate
+    return list(by_file_id.values())
+
+
+INDEX_FILE = "scan_index.db"  # Lives next to client.ini.
+
+# Directories modified this recently may still change within the same mtime tick, so don't trust them.
+INDEX_MTIME_GRACE_NS = 2_000_000_000
+
+
+class ScanIndex:
+    """Persistent index of previously scanned directories.
+
+    A directory whose mtime hasn't changed since the last run has the same entries it had back then,
+    so its files and subdirectories are served from the database instead of being listed and stat'ed again.
+    Note that a file changing size in place does not touch its directory's mtime; use --rebuild-index for that.
+    """
+
+    def __init__(self, db_path: os.PathLike | str = INDEX_FILE, rebuild: bool = False, shared: bool = False):
+        self.db_path = Path(db_path)
+        self.shared = shared  # Other processes write to it too, so keep write transactions short.
+        if rebuild and self.db_path.exists():
+            print(f"Rebuilding scan index '{self.db_path}'")
+            self.db_path.unlink()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=60 if shared else 5, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+            CREATE TABLE IF NOT EXISTS files (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                dev INTEGER NOT NULL,
+                ino INTEGER NOT NULL,
+                blocks INTEGER NOT NULL DEFAULT -1,
+                PRIMARY KEY (dir, name)
+            );
+            CREATE TABLE IF NOT EXISTS digests (
+                dev INTEGER NOT NULL,
+                ino INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                digest BLOB NOT NULL,
+                PRIMARY KEY (dev, ino, kind)
+            );
+            CREATE TABLE IF NOT EXISTS file_lists (
+                hash TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                files BLOB NOT NULL
+            );
+            """,
+        )
+        self.dirs_rescanned = 0
+        self.dirs_reused = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def _stored_mtime(self, dir_path: str) -> int | None:
+        row = self._conn.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (dir_path,)).fetchone()
+        return row[0] if row else None
+
+    def _forget_tree(self, dir_path: str) -> None:
+        """Drop a directory and everything below it."""
+        prefix = dir_path.rstrip(os.sep) + os.sep
+        like = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        self._conn.execute("DELETE FROM files WHERE dir = ? OR dir LIKE ? ESCAPE '\\'", (dir_path, like))
+        self._conn.execute("DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (dir_path, like))
+
+    def scan_dir(self, dir_path: str) -> tuple[list[DiskFile], list[str]]:
+        """Returns (files, subdirectories) of dir_path, listing it from disk only if it changed.
+
+        A listing that hit errors is stored untrusted, so the next run lists the directory again, and doesn't
+        forget subdirectories it may just have failed to see.
+        """
+        try:
+            dir_mtime_ns: int = os.stat(dir_path).st_mtime_ns
+        except OSError as e:  # removed or made unreadable since its parent was listed.
+            print(f"{Fore.YELLOW}Warning: could not list '{dir_path}': {e}{Style.RESET_ALL}")
+            return [], []
+        PROFILER.count("stats")
+        with self._lock:
+            if self._stored_mtime(dir_path) == dir_mtime_ns:
+                self.dirs_reused += 1
+                files = [
+                    DiskFile(os.path.join(dir_path, name), size, mtime_ns, dev, ino, blocks)
+                    for name, size, mtime_ns, dev, ino, blocks in self._conn.execute(
+                        "SELECT name, size, mtime_ns, dev, ino, blocks FROM files WHERE dir = ?",
+                        (dir_path,),
+                    )
+                ]
+                subdirs = [row[0] for row in self._conn.execute("SELECT path FROM dirs WHERE parent = ?", (dir_path,))]
+                return files, subdirs
+
+        files, subdirs, complete = list_dir(dir_path)
+        if complete is None:
+            return files, subdirs
+        trusted: bool = complete and time.time_ns() - dir_mtime_ns > INDEX_MTIME_GRACE_NS
+        trusted_mtime_ns = dir_mtime_ns if trusted else -1
+        with self._lock:
+            self.dirs_rescanned += 1
+            if complete:
+                subdir_set = set(subdirs)
+                for (old_subdir,) in self._conn.execute("SELECT path FROM dirs WHERE parent = ?", (dir_path,)).fetchall():
+                    if old_subdir not in subdir_set:
+                        self._forget_tree(old_subdir)
+            self._conn.execute("DELETE FROM files WHERE dir = ?", (dir_path,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (dir, name, size, mtime_ns, dev, ino, blocks) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(dir_path, os.path.basename(f.path), f.size, f.mtime_ns, f.dev, f.ino, f.blocks) for f in files],
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                (dir_path, os.path.dirname(dir_path), trusted_mtime_ns),
+            )
+            # Subdirectories we haven't visited yet get a placeholder so the parent lookup finds them next time.
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, -1)",
+                [(subdir, dir_path) for subdir in subdirs],
+            )
+            if self.shared:
+                self._conn.commit()
+        return files, subdirs
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+
+    def get_digest(self, key: tuple[int, int, int, int], kind: str) -> bytes | None:
+        """A content digest stored for the file (dev, ino, mtime_ns, size), if it hasn't changed since."""
+        dev, ino, mtime_ns, size = key
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest FROM digests WHERE dev = ? AND ino = ? AND kind = ? AND mtime_ns = ? AND size = ?",
+                (dev, ino, kind, mtime_ns, size),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_digest(self, key: tuple[int, int, int, int], kind: str, digest: bytes) -> None:
+        dev, ino, mtime_ns, size = key
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO digests (dev, ino, kind, mtime_ns, size, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                (dev, ino, kind, mtime_ns, size, digest),
+            )
+            if self.shared:
+                self._conn.commit()
+
+    def get_file_list(self, torrent_hash: str, signature: str) -> list[dict[str, Any]] | None:
+        """The file list stored for the torrent, if it was stored under the same signature."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT files FROM file_lists WHERE hash = ? AND signature = ?",
+                (torrent_hash, signature),
+            ).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def put_file_list(self, torrent_hash: str, signature: str, files: list[dict[str, Any]]) -> None:
+        blob = zlib.compress(json.dumps(files, separators=(",", ":")).encode())
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_lists (hash, signature, files) VALUES (?, ?, ?)",
+                (torrent_hash, signature, blob),
+            )
+            if self.shared:
+                self._conn.commit()
+
+    def forget_file_list(self, torrent_hash: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM file_lists WHERE hash = ?", (torrent_hash,))
+            if self.shared:
+                self._conn.commit()
+
+
+def scan_dir_from_disk(dir_path: str) -> tuple[list[DiskFile], list[str]]:
+    """Lists dir_path once, reusing the stat result scandir already has where it can."""
+    files, subdirs, _ = list_dir(dir_path)
+    return files, subdirs
+
+
+def list_dir(dir_path: str) -> tuple[list[DiskFile], list[str], bool | None]:
+    """Like scan_dir_from_disk(), also telling whether the listing is complete.
+
+    The third item is True if every entry was read, False if some were skipped after an error and None if
+    dir_path couldn't be listed at all.
+    """
+    files: list[DiskFile] = []
+    subdirs: list[str] = []
+    complete: bool | None = True
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        if not st.st_ino:  # Windows' DirEntry.stat() leaves st_ino and st_dev at 0.
+                            st = os.stat(entry.path)
+                        files.append(
+                            DiskFile(entry.path, st.st_size, st.st_mtime_ns, st.st_dev, st.st_ino, getattr(st, "st_blocks", -1)),
+                        )
+                except OSError as e:  # broken symlinks, permission errors, files vanishing mid-scan.
+                    print(f"{Fore.YELLOW}Warning: skipping '{entry.path}': {e}{Style.RESET_ALL}")
+                    complete = False
+    except OSError as e:
+        print(f"{Fore.YELLOW}Warning: could not list '{dir_path}': {e}{Style.RESET_ALL}")
+        complete = None
+    PROFILER.count("stats", len(files))
+    return files, subdirs, complete
+
+
+DEFAULT_SCAN_WORKERS = 8
+
+
+class TreeWalker:
+    """Streams the files below a directory, listing subdirectories in parallel.
+
+    Listing a directory and stat'ing its entries is mostly waiting on the filesystem (especially over NFS/SMB),
+    so a thread pool keeps several directories in flight. Files are filtered by size in the worker threads,
+    which means only the interesting ones ever reach the caller.
+    """
+
+    def __init__(self, workers: int = DEFAULT_SCAN_WORKERS, scan_index: ScanIndex | None = None):
+        self.workers = max(1, workers)
+        self.scan_index = scan_index
+        self.files_seen = 0
+        self.dirs_seen = 0
+
+    def _scan(self, dir_path: str, sizes: set[int] | None) -> tuple[list[DiskFile], list[str], int]:
+        files, subdirs = self.scan_index.scan_dir(dir_path) if self.scan_index else scan_dir_from_disk(dir_path)
+        if sizes is None:
+            return files, subdirs, len(files)
+        return [disk_file for disk_file in files if disk_file.size in sizes], subdirs, len(files)
+
+    def walk(
+        self,
+        search_path: os.PathLike | str,
+        sizes: set[int] | None = None,
+        on_dir: Callable[[str], None] | None = None,
+    ) -> Iterator[DiskFile]:
+        """Yields the files below search_path, only those with one of the given sizes if sizes is passed.
+
+        on_dir is called with each directory just before it is listed.
+        """
+        def submit(dir_path: str) -> Future:
+            if on_dir:
+                on_dir(dir_path)
+            return pool.submit(self._scan, dir_path, sizes)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            in_flight: set[Future] = {submit(os.path.abspath(search_path))}
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs, file_count = future.result()
+                    self.dirs_seen += 1
+                    self.files_seen += file_count
+                    in_flight.update(submit(subdir) for subdir in subdirs)
+                    yield from files
+
+
+def lower_suffix(name: str) -> str:
+    """Same as PurePath(name).suffix.lower() for a bare file name, without building a path object."""
+    dot = name.rfind(".")
+    if dot <= 0 or dot == len(name) - 1:
+        return ""
+    return name[dot:].lower()
+
+
+class SizeIndex:
+    """Compact index of scanned files, looked up by size.
+
+    Sizes live in a sorted integer array searched with bisect. Directories and extensions are interned
+    into small tables so each file costs a few array slots plus its base name, instead of a full path string.
+    Directories are also kept sorted by path, so the ones below a search path are a bisected range, and
+    views are cached per search path for the torrents sharing one.
+    """
+
+    def __init__(self):
+        self._dirs: list[str] = []
+        self._dir_ids: dict[str, int] = {}
+        self._extensions: list[str] = []
+        self._extension_ids: dict[str, int] = {}
+        self._sizes = array("q")
+        self._dir_column = array("L")
+        self._extension_column = array("L")
+        self._names: list[str] = []
+        self._devs = array("Q")
+        self._inos = array("Q")
+        self._blocks = array("q")
+        self._sorted = True
+        self._dirs_by_path: list[tuple[str, int]] | None = None  # (dir path, dir id), sorted, built on first use.
+        self._views: dict[str, SizeIndexView] = {}
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def add(self, path: str, size: int, dev: int = 0, ino: int = 0, blocks: int = -1) -> None:
+        dir_path, name = os.path.split(path)
+        dir_id = self._dir_ids.get(dir_path)
+        if dir_id is None:
+            dir_id = self._dir_ids[dir_path] = len(self._dirs)
+            self._dirs.append(dir_path)
+            self._dirs_by_path = None
+            self._views.clear()
+        extension = lower_suffix(name)
+        extension_id = self._extension_ids.get(extension)
+        if extension_id is None:
+            extension_id = self._extension_ids[extension] = len(self._extensions)
+            self._extensions.append(extension)
+
+        if self._sizes and size < self._sizes[-1]:
+            self._sorted = False
+        self._sizes.append(size)
+        self._dir_column.append(dir_id)
+        self._extension_column.append(extension_id)
+        self._names.append(name)
+        self._devs.append(dev)
+        self._inos.append(ino)
+        self._blocks.append(blocks)
+
+    def freeze(self) -> SizeIndex:
+        """Sorts the columns by size. Must be called after the last add() and before any lookup."""
+        if not self._sorted:
+            order = sorted(range(len(self._sizes)), key=self._sizes.__getitem__)
+            self._sizes = array("q", (self._sizes[i] for i in order))
+            self._dir_column = array("L", (self._dir_column[i] for i in order))
+            self._extension_column = array("L", (self._extension_column[i] for i in order))
+            self._names = [self._names[i] for i in order]
+            self._devs = array("Q", (self._devs[i] for i in order))
+            self._inos = array("Q", (self._inos[i] for i in order))
+            self._blocks = array("q", (self._blocks[i] for i in order))
+            self._sorted = True
+        return self
+
+    def _dirs_under(self, search_path: os.PathLike | str | None) -> set[int] | None:
+        if search_path is None:
+            return None
+        search_path = os.path.abspath(search_path)
+        if self._dirs_by_path is None:
+            self._dirs_by_path = sorted((dir_path, dir_id) for dir_id, dir_path in enumerate(self._dirs))
+        prefix = os.path.join(search_path, "")
+        # Paths starting with prefix sort between prefix and prefix with its separator bumped by one.
+        start = bisect.bisect_left(self._dirs_by_path, (prefix,))
+        end = bisect.bisect_left(self._dirs_by_path, (prefix[:-1] + chr(ord(prefix[-1]) + 1),), start)
+        dirs_under = {dir_id for _, dir_id in self._dirs_by_path[start:end]}
+        if search_path in self._dir_ids:
+            dirs_under.add(self._dir_ids[search_path])
+        return dirs_under
+
+    def _rows(self, size: int) -> range:
+        return range(bisect.bisect_left(self._sizes, size), bisect.bisect_right(self._sizes, size))
+
+    def candidates(
+        self,
+        size: int,
+        extension: str | None = None,
+        search_path: os.PathLike | str | None = None,
+        dirs_under: set[int] | None = None,
+    ) -> list[Candidate]:
+        """Files with the given size, optionally sharing a (lowercase) extension and below search_path."""
+        if dirs_under is None:
+            dirs_under = self._dirs_under(search_path)
+        extension_id = self._extension_ids.get(extension, -1) if extension is not None else None
+        return [
+            Candidate(
+                os.path.join(self._dirs[self._dir_column[row]], self._names[row]),
+                self._devs[row],
+                self._inos[row],
+                self._blocks[row],
+            )
+            for row in self._rows(size)
+            if (extension_id is None or self._extension_column[row] == extension_id)
+            and (dirs_under is None or self._dir_column[row] in dirs_under)
+        ]
+
+    def count(self, sizes: set[int], dirs_under: set[int] | None = None) -> int:
+        return sum(
+            1
+            for size in sizes
+            for row in self._rows(size)
+            if dirs_under is None or self._dir_column[row] in dirs_under
+        )
+
+    def view(self, search_path: os.PathLike | str) -> SizeIndexView:
+        key = os.path.abspath(search_path)
+        size_index_view = self._views.get(key)
+        if size_index_view is None:
+            dirs_under = self._dirs_under(key)
+            # A view of every directory needs no filter, which also makes its lookups cheaper.
+            size_index_view = self._views[key] = SizeIndexView(self, None if len(dirs_under or ()) == len(self._dirs) else dirs_under)
+        return size_index_view
+
+
+class SizeIndexView:
+    """A SizeIndex restricted to the directories below one search path."""
+
+    def __init__(self, size_index: SizeIndex, dirs_under: set[int] | None):
+        self.size_index = size_index
+        self.dirs_under = dirs_under
+
+    def candidates(self, size: int, extension: str | None = None) -> list[Candidate]:
+        return self.size_index.candidates(size, extension, dirs_under=self.dirs_under)
+
+    def count(self, sizes: set[int]) -> int:
+        return self.size_index.count(sizes, self.dirs_under)
+
+
+HARDLINK_MIN_SIZE = 512  # don't do anything with small files if hardlinking.
+
+
+def wanted_sizes(sizes: set[int], use_hardlinks: bool) -> set[int]:
+    if use_hardlinks:
+        return {size for size in sizes if size > HARDLINK_MIN_SIZE}
+    return sizes
+
+
 def get_matching_files_in_dir_and_subdirs(
     search_path: Path,
-    sizes: set[int],
+    sizes: set[int] | None,
     use_hardlinks: bool,
-) -> list[tuple[str, int]]:
-    files_in_directory: list[str] = [
-        os.path.join(dirpath, name)
-        for dirpath, _, filenames in os.walk(search_path)
-        for name in filenames
-    ]
-    print(f"Found {len(files_in_directory)} files in the search directory")
+    scan_index: ScanIndex | None = None,
+    workers: int = DEFAULT_SCAN_WORKERS,
+    max_files: int | None = None,
+) -> SizeIndex:
+    """Walks search_path once and indexes the files with one of the wanted sizes, or of any size if sizes is None.
+
+    With max_files, the walk stops as soon as the index holds more files than that, leaving it incomplete.
+    """
+    sizes = wanted_sizes(sizes, use_hardlinks) if sizes is not None else None
+    min_size: int = HARDLINK_MIN_SIZE if use_hardlinks and sizes is None else -1
+    size_index = SizeIndex()
+    walker = TreeWalker(workers, scan_index)
+    with PROFILER.phase("walk"):
+        for disk_file in walker.walk(search_path, sizes):
+            if disk_file.size <= min_size:
+                continue
+            size_index.add(disk_file.path, disk_file.size, disk_file.dev, disk_file.ino, disk_file.blocks)
+            if max_files is not None and len(size_index) > max_files:
+                break
+    PROFILER.count("files_scanned", walker.files_seen)
+    PROFILER.count("dirs_scanned", walker.dirs_seen)
+    print(f"Found {walker.files_seen} files in the search directory")
+    if scan_index:
+        scan_index.commit()
+
+    return size_index.freeze()
+
+
+class Manifest(NamedTuple):
+    """A file list written on the storage server, used instead of scanning, see iter_manifest()."""
+    path: Path
+    remaps: list[tuple[str, str]]  # (prefix in the manifest, local prefix)
+
+
+MANIFEST_NO_DEVICE = 2**64 - 1  # Rows without an inode or device get this device and their row number as inode.
+
+
+def open_manifest(manifest_file: Path) -> TextIO:
+    """Opens a manifest as text, decompressing .gz, .bz2 and .xz files."""
+    suffix = manifest_file.suffix.lower()
+    if suffix == ".gz":
+        import gzip  # pylint: disable=C0415
+        return gzip.open(manifest_file, "rt", encoding="utf-8", newline="")  # type: ignore[return-value]
+    if suffix == ".bz2":
+        import bz2  # pylint: disable=C0415
+        return bz2.open(manifest_file, "rt", encoding="utf-8", newline="")  # type: ignore[return-value]
+    if suffix == ".xz":
+        import lzma  # pylint: disable=C0415
+        return lzma.open(manifest_file, "rt", encoding="utf-8", newline="")  # type: ignore[return-value]
+    return manifest_file.open(encoding="utf-8", newline="")
+
+
+def remap_path(path: str, remaps: list[tuple[str, str]]) -> str:
+    """Replaces the first matching remote prefix of path with its local one."""
+    for remote, local in remaps:
+        remote = remote.rstrip("/")
+        if path == remote or path.startswith(remote + "/"):
+            return os.path.normpath(local + path[len(remote):])
+    return os.path.normpath(path)
+
+
+def iter_manifest(manifest: Manifest) -> Iterator[tuple[str, int, int, int, int]]:
+    """Yields (path, size, dev, ino, blocks) for every file in a manifest, reading it as a stream.
+
+    The format goes by the extension, under an optional compression one:
+
+    * .csv: a header naming the columns, path and size are required, ino (or inode), dev and blocks are optional.
+    * .json / .jsonl: one JSON object per line, with the same keys.
+    * anything else: tab separated `find -printf` output, one or more numbers followed by the path. They are
+      size, inode and device, in that order: `find /data -type f -printf '%s\t%i\t%D\t%p\n'`.
+    """
+    name = manifest.path.name.lower()
+    for compression in (".gz", ".bz2", ".xz"):
+        name = name[: -len(compression)] if name.endswith(compression) else name
+    with open_manifest(manifest.path) as f:
+        if name.endswith(".csv"):
+            import csv  # pylint: disable=C0415
+            rows: Iterator[dict[str, Any]] = csv.DictReader(f)
+        elif name.endswith((".json", ".jsonl")):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = _find_rows(f)
+        for row_number, row in enumerate(rows):
+            ino = row.get("ino", row.get("inode"))
+            dev = row.get("dev")
+            blocks = row.get("blocks")
+            if ino in (None, "") or dev in (None, ""):
+                # An inode means nothing without its volume, so such rows are never taken for hardlinks of each other.
+                dev, ino = MANIFEST_NO_DEVICE, row_number
+            yield (
+                remap_path(row["path"], manifest.remaps),
+                int(row["size"]),
+                int(dev),
+                int(ino),
+                -1 if blocks in (None, "") else int(blocks),
+            )
 
-    files_and_sizes: list[tuple[str, int]] = []
-    for file in files_in_directory:
-        size: int = os.path.getsize(file)
-        if size <= 512 and use_hardlinks:  # don't do anything with small files if hardlinking.
+
+def _find_rows(lines: Iterator[str]) -> Iterator[dict[str, Any]]:
+    for line in lines:
+        fields = line.rstrip("\r\n").split("\t")
+        numbers: list[str] = []
+        while len(fields) > 1 and len(numbers) < 3 and fields[0].isdigit():
+            numbers.append(fields.pop(0))
+        if not numbers:
+            continue
+        yield dict(zip(("size", "ino", "dev"), numbers), path="\t".join(fields))
+
+
+def load_manifest(manifest: Manifest, sizes: set[int]) -> SizeIndex:
+    """Indexes the files of a manifest with one of the wanted sizes."""
+    size_index = SizeIndex()
+    files_seen = 0
+    with PROFILER.phase("manifest"):
+        for path, size, dev, ino, blocks in iter_manifest(manifest):
+            files_seen += 1
+            if size in sizes:
+                size_index.add(path, size, dev, ino, blocks)
+    PROFILER.count("files_scanned", files_seen)
+    print(f"Found {files_seen} files in '{manifest.path}', {len(size_index)} of a wanted size")
+    return size_index.freeze()
+
+API_CONCURRENCY = 8  # Renames in flight at once, also the size of the HTTP connection pool.
+
+
+def supports_path_renames(qb_client: Client) -> bool:
+    """renameFile takes oldPath/newPath since qBittorrent v4.3.3, older versions want a file id."""
+    version = qb_client.app_version().lstrip("v").split("-")[0]
+    try:
+        return tuple(int(part) for part in version.split(".")[:3]) >= (4, 3, 3)
+    except ValueError:
+        return True
+
+
+class PendingRename(NamedTuple):
+    torrent_file: TorrentFile
+    old_path: str
+    new_path: str
+    selected_file_path: str
+
+
+class RenameStep(NamedTuple):
+    """One renameFile call. A rename in a cycle takes two, through a temporary name."""
+    rename: PendingRename
+    old_path: str
+    new_path: str
+
+
+class RenamePlan(NamedTuple):
+    waves: list[list[RenameStep]]  # Sent one after the other, the steps within a wave at once.
+    conflicts: list[tuple[PendingRename, Conflict409Error]]  # Renames that would be refused, never sent.
+
+
+def plan_renames(renames: list[PendingRename], existing_names: Iterable[str] = ()) -> RenamePlan:
+    """Orders the renames of one torrent so none of them hits a name that is still taken.
+
+    A rename onto a name another file of the torrent keeps, or onto the target of an earlier rename,
+    is a conflict. A rename onto a name that another rename moves away from waits for that rename,
+    and renames that wait for each other in a circle (swaps) are broken up by moving one of the files
+    to a temporary name first.
+    """
+    conflicts: list[tuple[PendingRename, Conflict409Error]] = []
+    targets: set[str] = set()
+    moving: dict[str, PendingRename] = {}  # old path -> rename
+    for pending in renames:
+        if pending.new_path in targets:
+            conflicts.append((pending, Conflict409Error(f"another file is already being renamed to '{pending.new_path}'")))
+            continue
+        targets.add(pending.new_path)
+        moving[pending.old_path] = pending
+
+    taken: set[str] = set(existing_names) | {pending.old_path for pending in renames}
+    staying: set[str] = taken - set(moving)
+    while True:  # A file that can't move keeps its name taken, which may block the next one.
+        blocked: list[PendingRename] = [pending for pending in moving.values() if pending.new_path in staying]
+        if not blocked:
+            break
+        for pending in blocked:
+            conflicts.append((pending, Conflict409Error(f"'{pending.new_path}' is already a file of the torrent")))
+            del moving[pending.old_path]
+            staying.add(pending.old_path)
+
+    vacated: dict[str, int] = {}  # old path -> wave its file moves away in
+    steps: list[tuple[int, RenameStep]] = []
+    for start in moving:
+        chain: list[str] = []
+        on_chain: set[str] = set()
+        old_path = start
+        while old_path in moving and old_path not in vacated and old_path not in on_chain:
+            chain.append(old_path)
+            on_chain.add(old_path)
+            old_path = moving[old_path].new_path
+        broken: str | None = old_path if old_path in on_chain else None
+        temporary = ""
+        if broken is not None:
+            temporary = f"{broken}.swap"
+            while temporary in taken or temporary in targets:
+                temporary += "_"
+            taken.add(temporary)
+            steps.append((0, RenameStep(moving[broken], broken, temporary)))
+            vacated[broken] = 0
+        for old_path in reversed(chain):
+            if old_path == broken:
+                continue
+            pending = moving[old_path]
+            vacated[old_path] = vacated.get(pending.new_path, -1) + 1
+            steps.append((vacated[old_path], RenameStep(pending, old_path, pending.new_path)))
+        if broken is not None:
+            pending = moving[broken]
+            steps.append((vacated[pending.new_path] + 1, RenameStep(pending, temporary, pending.new_path)))
+
+    waves: list[list[RenameStep]] = [[] for _ in range(max((wave for wave, _ in steps), default=-1) + 1)]
+    for wave, step in steps:
+        waves[wave].append(step)
+    return RenamePlan(waves, conflicts)
+
+
+RECHECK_MODES = ("batch", "defer", "off")
+RECHECKS_PER_DEVICE = 1  # Rechecks read a torrent's whole content, more than one per disk just makes them seek.
+RECHECK_POLL_INTERVAL = 2.0
+RECHECK_START_GRACE = 5.0  # How long a recheck that was asked for may take to show up as checking.
+CHECKING_STATES = {"checkingUP", "checkingDL", "checkingResumeData", "queuedForChecking"}
+
+
+class RecheckScheduler:
+    """Queues the torrents that need a recheck and starts them a few at a time per device.
+
+    "batch" starts queued rechecks during the run, as soon as their device has a free slot, "defer" holds
+    them all until finish() so they don't compete with the scans, and "off" only lists them. Rechecks
+    that become startable together go out in one torrents_recheck call. Running rechecks are polled
+    through torrents_info to know when a slot frees up.
+    """
+
+    def __init__(
+        self,
+        qb_client: Client,
+        mode: str = "batch",
+        per_device: int = RECHECKS_PER_DEVICE,
+        poll_interval: float = RECHECK_POLL_INTERVAL,
+    ):
+        self.qb_client = qb_client
+        self.mode = mode
+        self.per_device = max(1, per_device)
+        self.poll_interval = poll_interval
+        self.queued: dict[int, list[str]] = {}  # device -> hashes, in the order they were added
+        self.running: dict[str, tuple[int, float]] = {}  # hash -> (device, when it was started)
+        self.seen_checking: set[str] = set()
+        self.progress: dict[str, tuple[str, float]] = {}  # hash -> (name, progress) of running rechecks
+        self.done = 0
+        self.total = 0
+        self.skipped: list[str] = []
+        self._last_poll = 0.0
+
+    def add(self, torrent_hash: str, save_path: Path | str | None = None) -> None:
+        """Queues a recheck of the torrent, whose content lives under save_path."""
+        if self.mode == "off":
+            self.skipped.append(torrent_hash)
+            return
+        if torrent_hash in self.running or any(torrent_hash in hashes for hashes in self.queued.values()):
+            return
+        try:
+            device: int = os.stat(save_path).st_dev if save_path else -1
+        except OSError:
+            device = -1
+        self.queued.setdefault(device, []).append(torrent_hash)
+        self.total += 1
+        if self.mode == "batch":
+            self.pump()
+        else:
+            print(f"Recheck deferred, {self.queued_count} queued")
+
+    def pump(self, force_poll: bool = False) -> None:
+        """Forgets finished rechecks and starts as many queued ones as the devices have slots for."""
+        if self.running and (force_poll or time.monotonic() - self._last_poll >= self.poll_interval):
+            self._poll()
+        starting: list[str] = []
+        running_per_device: dict[int, int] = {}
+        for device, _ in self.running.values():
+            running_per_device[device] = running_per_device.get(device, 0) + 1
+        for device, hashes in self.queued.items():
+            free = self.per_device - running_per_device.get(device, 0)
+            while free > 0 and hashes:
+                torrent_hash = hashes.pop(0)
+                self.running[torrent_hash] = (device, time.monotonic())
+                starting.append(torrent_hash)
+                free -= 1
+        self.queued = {device: hashes for device, hashes in self.queued.items() if hashes}
+        if starting:
+            print(f"{Fore.LIGHTMAGENTA_EX}Rechecking {len(starting)} torrent(s), {self.queued_count} waiting for their disk{Style.RESET_ALL}")
+            self.qb_client.torrents_recheck(torrent_hashes=starting)
+
+    @property
+    def queued_count(self) -> int:
+        return sum(len(hashes) for hashes in self.queued.values())
+
+    def _poll(self) -> None:
+        self._last_poll = time.monotonic()
+        states: dict[str, Any] = {
+            torrent.hash.upper(): torrent for torrent in self.qb_client.torrents_info(torrent_hashes=list(self.running))
+        }
+        for torrent_hash, (_, started) in list(self.running.items()):
+            torrent = states.get(torrent_hash)
+            if torrent is not None and torrent.state in CHECKING_STATES:
+                self.seen_checking.add(torrent_hash)
+                self.progress[torrent_hash] = (torrent.name, torrent.progress)
+                continue
+            if torrent is not None and torrent_hash not in self.seen_checking and self._last_poll - started < RECHECK_START_GRACE:
+                continue  # Not picked up by qBittorrent yet.
+            del self.running[torrent_hash]
+            self.seen_checking.discard(torrent_hash)
+            self.progress.pop(torrent_hash, None)
+            self.done += 1
+
+    def report(self) -> None:
+        checking = ", ".join(f"{name} {progress:.0%}" for name, progress in self.progress.values())
+        print(
+            f"Rechecks: {self.done}/{self.total} done, {len(self.running)} running, {self.queued_count} queued"
+            + (f" ({checking})" if checking else ""),
+        )
+
+    def list_skipped(self) -> None:
+        if self.skipped:
+            print(f"{Fore.YELLOW}Rechecks are off, recheck these torrents yourself:{Style.RESET_ALL}")
+            print("\n".join(self.skipped))
+            self.skipped = []
+
+    def finish(self, wait: bool = True) -> None:
+        """Starts what is still queued, waiting for free slots and reporting progress meanwhile.
+
+        Returns once everything has been started, the last rechecks carry on in qBittorrent. Ctrl+C stops
+        the wait, listing the torrents whose recheck wasn't started, as "off" does.
+        """
+        self.list_skipped()
+        if not self.total:
+            return
+        self.pump(force_poll=True)
+        if wait and self.queued:
+            print(f"Waiting to start {self.queued_count} queued recheck(s), Ctrl+C to stop waiting")
+        try:
+            while wait and self.queued:
+                time.sleep(self.poll_interval)
+                self.pump(force_poll=True)
+                self.report()
+        except KeyboardInterrupt:
+            print()
+        if self.queued:
+            print(f"{Fore.YELLOW}{self.queued_count} recheck(s) were never started:{Style.RESET_ALL}")
+            print("\n".join(torrent_hash for hashes in self.queued.values() for torrent_hash in hashes))
+        elif self.running:
+            print(f"All rechecks started, {len(self.running)} still running in qBittorrent")
+
+
+class TorrentChanges:
+    """Collects the changes for one torrent and sends them in as few requests as possible.
+
+    Priority changes are grouped by priority and sent as one filePrio call each.
+    Renames can't be batched by the Web API, so they are pipelined over the pooled session instead.
+    """
+
+    def __init__(
+        self,
+        qb_client: Client,
+        torrent_hash: str,
+        rename_by_path: bool = True,
+        concurrency: int = API_CONCURRENCY,
+        rechecks: RecheckScheduler | None = None,
+    ):
+        self.qb_client = qb_client
+        self.torrent_hash = torrent_hash
+        self.rename_by_path = rename_by_path
+        self.concurrency = concurrency
+        self.rechecks = rechecks
+        self.priorities: dict[int, list[int]] = {}
+        self.renames: list[PendingRename] = []
+
+    def set_priority(self, torrent_file: TorrentFile, priority: int) -> None:
+        print(f"setting file priority of '{torrent_file.name}' to {priority}.")
+        self.priorities.setdefault(priority, []).append(int(torrent_file.index))
+
+    def rename(self, torrent_file: TorrentFile, new_path: str, selected_file_path: str) -> None:
+        self.renames.append(PendingRename(torrent_file, str(torrent_file.name), new_path, selected_file_path))
+
+    def _send_rename(self, step: RenameStep) -> None:
+        post: Callable | None = getattr(self.qb_client, "_post", None)
+        if self.rename_by_path and post is not None:
+            # torrents_rename_file() asks for the app and Web API versions before every rename,
+            # supports_path_renames() already checked them once for the whole run. _post() is private to
+            # qbittorrent-api, the public call below is used if it goes away or its signature changes.
+            try:
+                post(
+                    _name="torrents",
+                    _method="renameFile",
+                    data={"hash": self.torrent_hash, "oldPath": step.old_path, "newPath": step.new_path},
+                )
+                return
+            except TypeError:
+                pass
+        if self.rename_by_path:
+            self.qb_client.torrents_rename_file(
+                torrent_hash=self.torrent_hash,
+                old_path=step.old_path,
+                new_path=step.new_path,
+            )
+        else:
+            self.qb_client.torrents_rename_file(
+                torrent_hash=self.torrent_hash,
+                file_id=step.rename.torrent_file.id,
+                new_file_name=step.new_path,
+            )
+
+    def _give_up(self, step: RenameStep, cause: Conflict409Error) -> Conflict409Error:
+        """The error for a step whose target is still taken, after moving its file back from a temporary name."""
+        error = Conflict409Error(f"'{step.new_path}' wasn't freed, its own rename failed: {cause}")
+        if step.old_path == step.rename.old_path:
+            return error
+        rollback = RenameStep(step.rename, step.old_path, step.rename.old_path)
+        if self._try_rename(rollback) is not None:
+            return Conflict409Error(f"{error}. The file was left renamed to '{step.old_path}'")
+        return error
+
+    def _try_rename(self, step: RenameStep) -> Conflict409Error | None:
+        try:
+            self._send_rename(step)
+        except Conflict409Error as e:
+            return e
+        return None
+
+    def send_renames(self, existing_names: Iterable[str] = ()) -> list[tuple[PendingRename, Conflict409Error | None]]:
+        """Sends the queued renames, returning each one with the conflict it ran into, if any.
+
+        existing_names are the torrent's current file names. plan_renames() works out up front which
+        renames would conflict and in which order the others go through, each wave is pipelined.
+        A step waiting for a name that a failed rename was to free isn't sent. If its file already sits
+        under a temporary name, it is moved back to its old name.
+        """
+        renames, self.renames = self.renames, []
+        if not renames:
+            return []
+        plan: RenamePlan = plan_renames(renames, existing_names)
+        failed: dict[str, Conflict409Error] = {pending.old_path: error for pending, error in plan.conflicts}
+        for wave in plan.waves:
+            sendable: list[RenameStep] = []
+            for step in wave:
+                if step.rename.old_path in failed:  # A swap whose first half failed stops there.
+                    continue
+                if step.new_path in failed:
+                    failed[step.rename.old_path] = self._give_up(step, failed[step.new_path])
+                    continue
+                sendable.append(step)
+            if not sendable:
+                continue
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(sendable))) as pool:
+                for step, error in zip(sendable, pool.map(PROFILER.wrap(self._try_rename), sendable)):
+                    if error is not None:
+                        failed[step.rename.old_path] = error
+        TORRENT_FILE_CACHE.forget(self.torrent_hash)
+        return [(pending, failed.get(pending.old_path)) for pending in renames]
+
+    def send_priorities(self) -> None:
+        priorities, self.priorities = self.priorities, {}
+        for priority, file_ids in priorities.items():
+            self.qb_client.torrents_file_priority(
+                torrent_hash=self.torrent_hash,
+                file_ids=file_ids,
+                priority=priority,
+            )
+
+    def hardlink(
+        self,
+        paths: list[Path | str],
+        known_files: dict[str, Candidate] | None = None,
+        own_file: Path | str | None = None,
+    ) -> None:
+        hardlink_largest_file(paths, known_files, own_file)
+
+    def set_location(self, location: Path) -> None:
+        print(f"Changing torrent save location to {location}")
+        self.qb_client.torrents_set_location(torrent_hashes=self.torrent_hash, location=str(location))
+
+    def recheck(self, save_path: Path | str | None = None) -> None:
+        if self.rechecks:
+            self.rechecks.add(self.torrent_hash, save_path)
+        else:
+            self.qb_client.torrents_recheck(self.torrent_hash)
+
+    def unresolved(self, torrent_file: TorrentFile, candidates: list[tuple[float, str]]) -> None:
+        """A file with several candidates and nobody to ask. Only a plan keeps track of these."""
+        print(f"{Fore.YELLOW}Skipped '{torrent_file.name}', {len(candidates)} candidates and nobody to ask{Style.RESET_ALL}")
+
+
+class Plan:
+    """Every change a run would make, written to JSON by --plan and carried out later by --apply."""
+
+    VERSION = 1
+
+    def __init__(self, torrents: list[dict[str, Any]] | None = None):
+        self.torrents: list[dict[str, Any]] = torrents if torrents is not None else []
+
+    def save(self, plan_file: Path) -> None:
+        with plan_file.open("w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "torrents": self.torrents}, f, indent=1)
+
+    @classmethod
+    def load(cls, plan_file: Path) -> Plan:
+        with plan_file.open(encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != cls.VERSION:
+            sys.exit(f"Unsupported plan version in '{plan_file}': {data.get('version')}")
+        return cls(data["torrents"])
+
+
+class PlannedTorrentChanges(TorrentChanges):
+    """Records the changes for one torrent into a plan instead of sending them."""
+
+    def __init__(self, plan: Plan, torrent_hash: str, torrent_name: str):
+        super().__init__(None, torrent_hash)  # type: ignore[arg-type]
+        self.entry: dict[str, Any] = {
+            "hash": torrent_hash,
+            "name": torrent_name,
+            "renames": [],
+            "priorities": {},
+            "hardlinks": [],
+            "location": None,
+            "recheck": False,
+            "unresolved": [],
+            "conflicts": [],
+        }
+        plan.torrents.append(self.entry)
+
+    def send_renames(self, existing_names: Iterable[str] = ()) -> list[tuple[PendingRename, Conflict409Error | None]]:
+        """Records the renames that won't conflict. Their order is worked out again when the plan is applied.
+
+        The others are recorded as conflicts, for whoever carries out the plan to decide on.
+        """
+        renames, self.renames = self.renames, []
+        conflicts: dict[str, Conflict409Error] = {
+            pending.old_path: error for pending, error in plan_renames(renames, existing_names).conflicts
+        }
+        for pending in renames:
+            if pending.old_path in conflicts:
+                self.entry["conflicts"].append(
+                    {
+                        "index": pending.torrent_file.index,
+                        "old": pending.old_path,
+                        "new": pending.new_path,
+                        "disk_file": pending.selected_file_path,
+                        "error": str(conflicts[pending.old_path]),
+                    },
+                )
+                continue
+            self.entry["renames"].append(
+                {
+                    "id": pending.torrent_file.id,
+                    "index": pending.torrent_file.index,
+                    "priority": pending.torrent_file.priority,
+                    "old": pending.old_path,
+                    "new": pending.new_path,
+                    "disk_file": pending.selected_file_path,
+                },
+            )
+        return [(pending, conflicts.get(pending.old_path)) for pending in renames]
+
+    def send_priorities(self) -> None:
+        priorities, self.priorities = self.priorities, {}
+        for priority, file_ids in priorities.items():
+            self.entry["priorities"].setdefault(str(priority), []).extend(file_ids)
+
+    def hardlink(
+        self,
+        paths: list[Path | str],
+        known_files: dict[str, Candidate] | None = None,
+        own_file: Path | str | None = None,
+    ) -> None:
+        self.entry["hardlinks"].append({"paths": [str(path) for path in paths], "own_file": str(own_file) if own_file else None})
+
+    def set_location(self, location: Path) -> None:
+        self.entry["location"] = str(location)
+
+    def recheck(self, save_path: Path | str | None = None) -> None:
+        self.entry["recheck"] = str(save_path) if save_path else True  # Where the content is, for --apply's scheduler.
+
+    def unresolved(self, torrent_file: TorrentFile, candidates: list[tuple[float, str]]) -> None:
+        print(f"{Fore.YELLOW}Left '{torrent_file.name}' unresolved, {len(candidates)} candidates{Style.RESET_ALL}")
+        self.entry["unresolved"].append(
+            {
+                "index": torrent_file.index,
+                "name": torrent_file.name,
+                "size": torrent_file.size,
+                "candidates": [[path, round(score, 3)] for score, path in candidates],
+            },
+        )
+
+
+def apply_plan(
+    plan_file: Path,
+    recheck_mode: str = "batch",
+    rechecks_per_device: int = RECHECKS_PER_DEVICE,
+    use_scan_index: bool = True,
+) -> None:
+    """Carries out a plan written by --plan, without scanning anything.
+
+    The scan index is still opened, so the stored file lists of renamed torrents are dropped.
+    """
+    plan = Plan.load(plan_file)
+    qb_client: Client = init_client()
+    rename_by_path: bool = supports_path_renames(qb_client)
+    print("Connected to api!")
+    rechecks = RecheckScheduler(qb_client, recheck_mode, rechecks_per_device)
+    scan_index: ScanIndex | None = ScanIndex(INDEX_FILE) if use_scan_index else None
+    TORRENT_FILE_CACHE.scan_index = scan_index
+    try:
+        for entry in plan.torrents:
+            print(f"\nApplying plan for torrent: {entry['name']}")
+            apply_plan_entry(qb_client, entry, rename_by_path, rechecks)
+            for unresolved in entry["unresolved"]:
+                print(f"{Fore.YELLOW}Skipped unresolved '{unresolved['name']}' ({len(unresolved['candidates'])} candidates){Style.RESET_ALL}")
+            for conflict in entry["conflicts"]:
+                print(f"{Fore.YELLOW}Skipped rename of '{conflict['old']}' to '{conflict['new']}': {conflict['error']}{Style.RESET_ALL}")
+    finally:
+        TORRENT_FILE_CACHE.scan_index = None
+        if scan_index:
+            scan_index.close()
+    rechecks.finish()
+
+
+def apply_plan_entry(
+    qb_client: Client,
+    entry: dict[str, Any],
+    rename_by_path: bool,
+    rechecks: RecheckScheduler | None = None,
+) -> None:
+    """Makes the changes a plan holds for one torrent."""
+    changes = TorrentChanges(qb_client, entry["hash"], rename_by_path, rechecks=rechecks)
+    for hardlink in entry["hardlinks"]:
+        changes.hardlink(hardlink["paths"], own_file=hardlink["own_file"])
+    for rename in entry["renames"]:
+        torrent_file = TorrentFile({"id": rename["id"], "index": rename["index"], "name": rename["old"], "priority": rename["priority"]})
+        changes.rename(torrent_file, rename["new"], rename["disk_file"])
+    for pending, error in changes.send_renames():
+        if error is None:
+            print(f"Renaming file:\n{pending.old_path} ->\n{Fore.GREEN}{pending.new_path}{Style.RESET_ALL}")
+        else:
+            print(f"{Fore.RED}'{pending.old_path}' error:", error, Style.RESET_ALL)
+    for priority, file_ids in entry["priorities"].items():
+        print(f"setting file priority of {len(file_ids)} file(s) to {priority}.")
+        changes.priorities.setdefault(int(priority), []).extend(file_ids)
+    changes.send_priorities()
+    if entry["location"]:
+        changes.set_location(Path(entry["location"]))
+    if entry["recheck"]:
+        print(f"{Fore.LIGHTMAGENTA_EX}Rechecking torrent{Style.RESET_ALL}")
+        changes.recheck(entry["recheck"] if isinstance(entry["recheck"], str) else entry["location"])
+
+
+class MatchOptions(NamedTuple):
+    """How match() should treat each torrent, as set on the command line."""
+    match_extension: bool = False
+    use_hardlinks: bool = False
+    no_redownload: bool = False
+    is_dry_run: bool = False
+    verify_pieces: bool = False
+    auto_pick_threshold: float | None = None
+    interactive: bool = True  # False when nobody is there to answer prompts, as in --watch.
+
+
+AUTO_PICK_THRESHOLD = 0.8  # Used by --auto-pick without a value, and by --plan.
+AUTO_PICK_MARGIN = 0.1  # How far ahead of the runner-up the best candidate must be.
+
+
+def score_candidates(
+    torrent_file_name: str,
+    candidates: list[str],
+    sibling_dirs: dict[str, set[str]],
+) -> list[tuple[float, str]]:
+    """Ranks same-size candidates for a torrent file, best first. Scores go from 0 to 1.
+
+    Half of the score is how similar the file names are, 30% is whether the candidate sits in a directory
+    where files from the same torrent folder were already found, and 20% is whether the extensions agree.
+    """
+    torrent_path = PurePath(torrent_file_name)
+    torrent_name = torrent_path.name.lower()
+    torrent_extension = torrent_path.suffix.lower()
+    torrent_folder = torrent_path.parent.as_posix()
+    same_folder_dirs: set[str] = sibling_dirs.get(torrent_folder, set())
+    any_folder_dirs: set[str] = set().union(*sibling_dirs.values()) if sibling_dirs else set()
+
+    scored: list[tuple[float, str]] = []
+    for candidate in candidates:
+        candidate_dir, candidate_name = os.path.split(candidate)
+        name_score = difflib.SequenceMatcher(None, torrent_name, candidate_name.lower()).ratio()
+        if candidate_dir in same_folder_dirs:
+            dir_score = 1.0
+        elif candidate_dir in any_folder_dirs:
+            dir_score = 0.5
+        else:
+            dir_score = 0.0
+        extension_score = 1.0 if lower_suffix(candidate_name) == torrent_extension else 0.0
+        scored.append((0.5 * name_score + 0.3 * dir_score + 0.2 * extension_score, candidate))
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+    return scored
+
+
+def pick_candidate(scored: list[tuple[float, str]], threshold: float) -> str | None:
+    """The best candidate, if it clears the threshold and beats the runner-up clearly."""
+    best_score, best = scored[0]
+    runner_up_score = scored[1][0] if len(scored) > 1 else 0.0
+    if best_score >= threshold and best_score - runner_up_score >= AUTO_PICK_MARGIN:
+        return best
+    return None
+
+
+
+def find_sibling_dirs(
+    torrent_files: list[TorrentFile],
+    files_in_directory: SizeIndexView,
+    match_extension: bool,
+) -> dict[str, set[str]]:
+    """Disk directories holding the files with a single match, keyed by their folder in the torrent."""
+    sibling_dirs: dict[str, set[str]] = {}
+    for torrent_file in torrent_files:
+        if torrent_file.priority == 0:
             continue
-        files_and_sizes.append((file, size))
+        name = str(torrent_file.name)
+        candidates = files_in_directory.candidates(
+            torrent_file.size,
+            lower_suffix(PurePath(name).name) if match_extension else None,
+        )
+        if len(candidates) == 1:
+            sibling_dirs.setdefault(PurePath(name).parent.as_posix(), set()).add(os.path.dirname(candidates[0].path))
+    return sibling_dirs
 
-    return [pair for pair in files_and_sizes if pair[1] in sizes]
 
 IGNORED_SUBFOLDERS: set[Path] = set()  # To keep track of ignored subfolders
 IGNORED_EXTENSIONS: set[str] = set()   # To keep track of ignored file extensions
 
 def match(
     torrent: TorrentDictionary,
-    files_in_directory: list[tuple[str, int]],
-    match_extension: bool,
+    torrent_files: list[TorrentFile],
+    changes: TorrentChanges,
+    files_in_directory: SizeIndexView,
     download_path: Path,
-    use_hardlinks: bool,
-    is_dry_run: bool,
-    no_redownload: bool,
+    options: MatchOptions,
+    only: set[str] | None = None,
 ) -> bool:
+    """Matches torrent_files, the torrent's whole file list, or just those named in only.
+
+    The other files still count for piece offsets and for the names renames must not collide with.
+    """
     global IGNORED_EXTENSIONS  # pylint: disable=W0602
     global IGNORED_SUBFOLDERS  # pylint: disable=W0602
 
+    match_extension: bool = options.match_extension
+    use_hardlinks: bool = options.use_hardlinks
+    no_redownload: bool = options.no_redownload
+    is_dry_run: bool = options.is_dry_run
+    auto_pick_threshold: float | None = options.auto_pick_threshold
+    is_planned: bool = isinstance(changes, PlannedTorrentChanges)
+    is_interactive: bool = options.interactive and not is_planned
+
     made_change: bool = False
     matched_files: set[str] = set()  # keep track of already matched files
+    known_files: dict[str, Candidate] = {}  # every candidate seen, so hardlinking doesn't stat them again
+    verifier: PieceVerifier | None = PieceVerifier(torrent, torrent_files) if options.verify_pieces else None
+    sibling_dirs: dict[str, set[str]] = (
+        find_sibling_dirs(torrent_files, files_in_directory, match_extension) if auto_pick_threshold is not None else {}
+    )
     torrent_file: TorrentFile
-    for torrent_file in torrent.files:  # type: ignore[reportAttributeAccessError]
-        if torrent_file.priority == 0:
+    for torrent_file in torrent_files:
+        if torrent_file.priority == 0 or (only is not None and str(torrent_file.name) not in only):
             continue
 
         original_relpath_str: str = str(torrent_file.name)
         original_relpath = PurePath(original_relpath_str)
         original_file_path: Path = download_path / original_relpath_str
 
-        matching_files: list[str] = [
-            disk_file_abs_path
-            for disk_file_abs_path, disk_file_size in files_in_directory
-            if torrent_file.size == disk_file_size
-            and (
-                not match_extension
-                or Path(disk_file_abs_path).suffix.lower()
-                == original_relpath.suffix.lower()
-            )
-            and disk_file_abs_path not in matched_files
-        ]
+        with PROFILER.phase("candidates"):
+            candidates: list[Candidate] = [
+                candidate
+                for candidate in files_in_directory.candidates(
+                    torrent_file.size,
+                    original_relpath.suffix.lower() if match_extension else None,
+                )
+                if candidate.path not in matched_files
+            ]
+            distinct: list[Candidate] = distinct_files(candidates)
+        PROFILER.count("candidates_evaluated", len(candidates))
+        known_files.update((candidate.path, candidate) for candidate in candidates)
+
+        if len(candidates) > 1 and len(distinct) == 1:
+            continue  # all hard/symlinked to the same file.
+        matching_files: list[str] = [candidate.path for candidate in distinct]
+        if len(matching_files) > 1 and verifier:
+            with PROFILER.phase("verify"):
+                matching_files = verifier.narrow(torrent_file, matching_files)
+
+        scored: list[tuple[float, str]] = []
+        if len(matching_files) > 1 and (auto_pick_threshold is not None or not is_interactive):
+            with PROFILER.phase("score"):
+                scored = score_candidates(original_relpath_str, matching_files, sibling_dirs)
+            picked = pick_candidate(scored, auto_pick_threshold) if auto_pick_threshold is not None else None
+            if picked:
+                print(f"Picked '{picked}' for '{original_relpath_str}' (score {scored[0][0]:.2f})")
+                matching_files = [picked]
 
         if len(matching_files) > 1:
-            if are_all_paths_same(matching_files):
-                continue  # all hard/symlinked to the same file.
             if is_dry_run:
                 print("Multiple files found (dryrun - would normally prompt to select)")
                 continue
+            if not is_interactive:
+                changes.unresolved(torrent_file, scored)
+                continue
             subfolder_to_ignore: Path = Path(matching_files[0]).parent
             if subfolder_to_ignore in IGNORED_SUBFOLDERS:
                 continue
@@ -262,7 +1987,8 @@ def match(
                     "name": "file",
                 },
             ]
-            response = prompt(question)
+            with PROFILER.phase("prompt"):
+                response = prompt(question)
             if response["file"] == skip_file_option:
                 continue
             if response["file"] == subfolder_ignore_option:
@@ -274,13 +2000,9 @@ def match(
                 #print(f"Ignoring file extension '{extension_to_ignore}' for this session.")
                 continue
             if response["file"] == hardlink_option:
-                hardlink_largest_file(matching_files)
+                changes.hardlink([candidate.path for candidate in candidates], known_files)
                 if torrent_file.priority in (0, "0"):
-                    print(f"setting file priority of '{torrent_file.name}' to 1.")
-                    torrent.file_priority(
-                        file_ids=torrent_file.index,
-                        priority=1,
-                    )  # type: ignore[reportCallIssue]
+                    changes.set_priority(torrent_file, 1)
                 #made_change = True
                 continue
 
@@ -293,13 +2015,10 @@ def match(
         else:
             print(f"{Fore.YELLOW}No matches found for '{original_relpath_str}'!{Style.RESET_ALL}")
             if no_redownload:
-                print(f"setting file priority of '{torrent_file.name}' to 0.")
                 if is_dry_run:
+                    print(f"setting file priority of '{torrent_file.name}' to 0.")
                     continue
-                torrent.file_priority(
-                    file_ids=int(torrent_file.index),
-                    priority=0,
-                )  # type: ignore[reportCallIssue]
+                changes.set_priority(torrent_file, 0)
                 #made_change = True
             continue
 
@@ -318,62 +2037,66 @@ def match(
         if use_hardlinks:
             print(f"Hardlinking file:\n{original_relpath_str} <--vv\n{Fore.GREEN}{new_relative_path_str}{Style.RESET_ALL}")
             args_list: list[Path | str] = [original_file_path, selected_file_path]
-            hardlink_largest_file(args_list)
+            changes.hardlink(args_list, known_files, own_file=original_file_path)
             if torrent_file.priority in (0, "0"):
-                print(f"setting file priority of '{torrent_file.name}' to 1.")
-                torrent.file_priority(
-                    file_ids=torrent_file.index,
-                    priority=1,
-                )  # type: ignore[reportCallIssue]
+                changes.set_priority(torrent_file, 1)
             #made_change = True
             continue
 
-        try:
-            torrent.rename_file(
-                file_id=torrent_file.id,
-                new_file_name=new_relative_path_str,
-            )  # type: ignore[reportCallIssue]
+        changes.rename(torrent_file, new_relative_path_str, selected_file_path)
+
+    with PROFILER.phase("api"):
+        renamed = changes.send_renames(str(file.name) for file in torrent_files)
+    for pending, error in renamed:
+        torrent_file = pending.torrent_file
+        if error is None:
+            action = "Planned rename" if is_planned else "Renaming file"
+            print(f"{action}:\n{pending.old_path} ->\n{Fore.GREEN}{pending.new_path}{Style.RESET_ALL}")
             if torrent_file.priority in (0, "0"):
-                print(f"setting file priority of '{torrent_file.name}' to 1.")
-                torrent.file_priority(
-                    file_ids=torrent_file.index,
-                    priority=1,
-                )  # type: ignore[reportCallIssue]
-        except Conflict409Error as e:
-            print(f"{Fore.RED}'{original_relpath_str}' error:", e)
-            if original_file_path.suffix.lower() in IGNORED_EXTENSIONS:
-                continue
-            hardlink_question: list[dict[str, Any]] = [
-                {
-                    "type": "list",
-                    "message": "Would you like to attempt hardlinking instead?",
-                    "choices": ["yes", "no"],
-                },
-            ]
-            response = prompt(hardlink_question)
-            if response[0] == "yes":
-                args_list = [original_file_path, selected_file_path]
-                hardlink_largest_file(args_list)
-                if torrent_file.priority in (0, "0"):
-                    print(f"setting file priority of '{torrent_file.name}' to 1.")
-                    torrent.file_priority(
-                        file_ids=torrent_file.index,
-                        priority=1,
-                    )  # type: ignore[reportCallIssue]
-                #made_change = True
-            elif no_redownload:
-                print(f"setting file priority of '{torrent_file.name}' to 0.")
-                torrent.file_priority(
-                    file_ids=torrent_file.index,
-                    priority=0,
-                )  # type: ignore[reportCallIssue]
-                #made_change = True
-        else:
-            print(f"Renaming file:\n{original_relpath_str} ->\n{Fore.GREEN}{new_relative_path}{Style.RESET_ALL}")
+                changes.set_priority(torrent_file, 1)
             #made_change = True
+            continue
+
+        print(f"{Fore.RED}'{pending.old_path}' error:", error)
+        if is_interactive:
+            handle_failed_rename(changes, pending, download_path, no_redownload, known_files)
+
+    with PROFILER.phase("api"):
+        changes.send_priorities()
 
     return made_change
 
+def handle_failed_rename(
+    changes: TorrentChanges,
+    pending: PendingRename,
+    download_path: Path,
+    no_redownload: bool,
+    known_files: dict[str, Candidate] | None = None,
+) -> None:
+    """Offers to hardlink a file whose rename failed, or with -nodl stops qBittorrent from downloading it."""
+    torrent_file = pending.torrent_file
+    original_file_path = download_path / pending.old_path
+    if original_file_path.suffix.lower() in IGNORED_EXTENSIONS:
+        return
+    hardlink_question: list[dict[str, Any]] = [
+        {
+            "type": "list",
+            "message": "Would you like to attempt hardlinking instead?",
+            "choices": ["yes", "no"],
+        },
+    ]
+    with PROFILER.phase("prompt"):
+        response = prompt(hardlink_question)
+    if response[0] == "yes":
+        args_list = [original_file_path, pending.selected_file_path]
+        changes.hardlink(args_list, known_files, own_file=original_file_path)
+        if torrent_file.priority in (0, "0"):
+            changes.set_priority(torrent_file, 1)
+        #made_change = True
+    elif no_redownload:
+        changes.set_priority(torrent_file, 0)
+        #made_change = True
+
 def set_search_and_download_paths(
     torrent: TorrentDictionary,
     input_search_path: Path | None,
@@ -409,73 +2132,1058 @@ def set_search_and_download_paths(
     return search_path, download_path
 
 
+TORRENT_PAGE_SIZE = 500  # Torrents fetched, scanned and matched at a time.
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    chunk: list[Any] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_torrents(
+    qb_client: Client,
+    torrent_hashes: Iterable[str] | None = None,
+    page_size: int = TORRENT_PAGE_SIZE,
+) -> Iterator[TorrentDictionary]:
+    """Yields the torrents with the given hashes, or every torrent, fetching page_size of them per request.
+
+    Hashes are looked up page_size at a time, and the ones qBittorrent doesn't know are reported as each
+    chunk comes back. Every torrent is paged through with limit/offset, oldest first, so torrents added
+    meanwhile land on the last page instead of shifting the ones not fetched yet.
+    """
+    if torrent_hashes is None:
+        offset = 0
+        while True:
+            page: TorrentInfoList = qb_client.torrents_info(sort="added_on", limit=page_size, offset=offset)
+            yield from page
+            if len(page) < page_size:
+                return
+            offset += len(page)
+
+    seen: set[str] = set()
+
+    def unseen_hashes() -> Iterator[str]:
+        for hash_value in torrent_hashes:  # type: ignore[union-attr]
+            if hash_value not in seen:
+                seen.add(hash_value)
+                yield hash_value
+
+    for chunk in chunked(unseen_hashes(), page_size):
+        page = qb_client.torrents_info(torrent_hashes=chunk)
+        found_hashes: set[str] = {torrent.hash.upper() for torrent in page}
+        for hash_value in chunk:
+            if hash_value not in found_hashes:
+                print(f"{Fore.RED}Torrent with hash '{hash_value}' not found.{Style.RESET_ALL}")
+        yield from page
+
+
+def read_hashes(hash_file: Path) -> Iterator[str]:
+    """Yields the hashes in a txt, one per line, reading it as they are needed."""
+    with hash_file.open(mode="r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield line.strip().upper()
+
+
 def matcher(
-    input_torrent_hashes: list[str],
+    input_torrent_hashes: Iterable[str],
+    options: MatchOptions,
     sync_all: bool = False,
     input_search_path: Path | None = None,
     input_download_path: Path | None = None,
     use_torrent_save_path_as_search_path: bool = False,
-    match_extension: bool = False,
-    use_hardlinks: bool = False,
-    no_redownload: bool = False,
-    is_dry_run: bool = False,
+    plan_file: Path | None = None,
+    scan_workers: int = DEFAULT_SCAN_WORKERS,
+    pipeline_jobs: int = 1,
+    use_scan_index: bool = True,
+    rebuild_scan_index: bool = False,
+    shards: int = 1,
+    recheck_mode: str = "batch",
+    rechecks_per_device: int = RECHECKS_PER_DEVICE,
+    manifest: Manifest | None = None,
 ):
+    """Matches the torrents a page at a time (see iter_torrents()), so memory doesn't grow with the library.
+
+    When there is more than one page, search roots are indexed with files of every size, as later pages
+    may need any of them, and kept for those pages within the bound of RootWalks.
+    """
     qb_client: Client = init_client()  # this doesn't mean we actually connected yet.
     if input_torrent_hashes:
-        torrents: TorrentInfoList = qb_client.torrents.info(torrent_hashes=input_torrent_hashes)
-        print("Connected to api!")
-        if not torrents:
-            sys.exit(f"{Fore.RED}No torrents found matching any of the provided hashes.{Style.RESET_ALL}")
-        else:
-            found_hashes: list[str] = [torrent["hash"].upper() for torrent in torrents]  # Extracting found hashes
-            for hash_value in input_torrent_hashes:
-                if hash_value not in found_hashes:
-                    print(f"{Fore.RED}Torrent with hash '{hash_value}' not found.{Style.RESET_ALL}")
+        torrents: Iterator[TorrentDictionary] = iter_torrents(qb_client, input_torrent_hashes)
     elif sync_all:
-        torrents = qb_client.torrents_info()
-        print("Connected to api!")
-        if not torrents:
-            sys.exit(f"{Fore.RED}No torrents found found anywhere in your qBittorrent{Style.RESET_ALL}")
+        torrents = iter_torrents(qb_client)
     else:
         sys.exit("Nothing to do?")
 
-    for torrent in torrents:
-        torrent_hash = torrent["hash"].upper()
-        print(f"\nTarget torrent: {torrent.name}")
-        search_path , download_path = set_search_and_download_paths(
-            torrent,
-            input_search_path,
-            input_download_path,
-            use_torrent_save_path_as_search_path,
-        )
-        if not search_path or not download_path:
-            # print(f"Skipping '{torrent.name}', no search path determined.\n")
+    rename_by_path: bool | None = None
+    plan: Plan | None = Plan() if plan_file else None
+    rechecks = RecheckScheduler(qb_client, recheck_mode, rechecks_per_device)
+    found = 0
+    root_walks: RootWalks | None = None  # Set once the first page turns out full.
+    scan_index: ScanIndex | None = None
+    if shards <= 1 and use_scan_index:
+        scan_index = ScanIndex(INDEX_FILE, rebuild=rebuild_scan_index)
+    CONTENT_DIGESTS.scan_index = TORRENT_FILE_CACHE.scan_index = scan_index
+    try:
+        for page in chunked(torrents, TORRENT_PAGE_SIZE):
+            if rename_by_path is None:
+                print("Connected to api!")
+                rename_by_path = supports_path_renames(qb_client)
+            found += len(page)
+            if root_walks is None and len(page) == TORRENT_PAGE_SIZE:
+                root_walks = RootWalks()
+            jobs: list[TorrentJob] = []
+            for torrent in page:
+                job = prepare_torrent_job(torrent, input_search_path, input_download_path, use_torrent_save_path_as_search_path)
+                if job:
+                    jobs.append(job)
+            if shards > 1:
+                match_sharded(
+                    qb_client, jobs, options, input_download_path, rename_by_path, plan,
+                    shards, scan_workers, use_scan_index, rebuild_scan_index and found == len(page), rechecks,
+                )
+                continue
+            groups: dict[Path, list[TorrentJob]] = group_by_search_root(jobs)
+            if manifest:
+                scanned = manifest_groups(groups, options.use_hardlinks, manifest)
+            elif pipeline_jobs > 1:
+                scanned = scan_groups_pipelined(groups, options.use_hardlinks, scan_index, scan_workers, pipeline_jobs, root_walks)
+            else:
+                scanned = scan_groups(groups, options.use_hardlinks, scan_index, scan_workers, root_walks)
+            for job, size_index in scanned:
+                process_torrent(qb_client, job, size_index, options, input_download_path, rename_by_path, plan, rechecks)
+    finally:
+        CONTENT_DIGESTS.scan_index = TORRENT_FILE_CACHE.scan_index = None
+        if scan_index:
+            scan_index.close()
+    if not found:
+        if input_torrent_hashes:
+            sys.exit(f"{Fore.RED}No torrents found matching any of the provided hashes.{Style.RESET_ALL}")
+        sys.exit(f"{Fore.RED}No torrents found found anywhere in your qBittorrent{Style.RESET_ALL}")
+    rechecks.finish()
+
+    if plan_file and plan is not None:
+        plan.save(plan_file)
+        print(f"\nPlan for {len(plan.torrents)} torrent(s) written to '{plan_file}', run with --apply to carry it out.")
+
+
+class TorrentJob(NamedTuple):
+    """A torrent along with where to look for its files."""
+    torrent: TorrentDictionary
+    search_path: Path
+    download_path: Path
+    files: list[TorrentFile]  # Empty until load_torrent_files() fetches them.
+    sizes: set[int]
+    cached: bool = False  # files came from TORRENT_FILE_CACHE, names and priorities may be out of date.
+
+
+def prepare_torrent_job(
+    torrent: TorrentDictionary,
+    input_search_path: Path | None,
+    input_download_path: Path | None,
+    use_torrent_save_path_as_search_path: bool,
+) -> TorrentJob | None:
+    print(f"\nTarget torrent: {torrent.name}")
+    search_path , download_path = set_search_and_download_paths(
+        torrent,
+        input_search_path,
+        input_download_path,
+        use_torrent_save_path_as_search_path,
+    )
+    if not search_path or not download_path:
+        # print(f"Skipping '{torrent.name}', no search path determined.\n")
+        return None
+
+    print(f"Search directory '{search_path}'\nDownload directory '{download_path}'")
+    return TorrentJob(torrent, search_path, download_path, [], set())
+
+
+def fetch_torrent_files(torrent: TorrentDictionary, use_cache: bool = True) -> tuple[list[TorrentFile], bool]:
+    """Returns the torrent's file list, and whether it came from TORRENT_FILE_CACHE rather than the API."""
+    cached: list[TorrentFile] | None = TORRENT_FILE_CACHE.get(torrent) if use_cache else None
+    if cached is not None:
+        PROFILER.count("file_lists_cached")
+        return cached, True
+    with PROFILER.phase("fetch_files"):
+        torrent_files: list[TorrentFile] = list(torrent.files)
+    TORRENT_FILE_CACHE.put(torrent, torrent_files)
+    return torrent_files, False
+
+
+def load_torrent_files(job: TorrentJob, use_cache: bool = True) -> TorrentJob:
+    torrent_files, cached = fetch_torrent_files(job.torrent, use_cache)
+    # Unfortunately hashing individual files isn't possible (or at least practical), so we match with their sizes.
+    torrent_file_sizes: set[int] = {file.size for file in torrent_files if file.size}
+    return job._replace(files=torrent_files, sizes=torrent_file_sizes, cached=cached)
+
+
+def files_in_place(job: TorrentJob, size_index: SizeIndex) -> bool:
+    """Whether every wanted file of the torrent was found by the scan under its name and size."""
+    for torrent_file in job.files:
+        if torrent_file.priority == 0 or not torrent_file.size:
             continue
+        expected_path = os.path.abspath(job.download_path / str(torrent_file.name))
+        if not any(candidate.path == expected_path for candidate in size_index.candidates(torrent_file.size)):
+            return False
+    return True
+
+
+def group_by_search_root(jobs: list[TorrentJob]) -> dict[Path, list[TorrentJob]]:
+    """Groups jobs under the outermost search path containing them, so nested search paths are walked only once."""
+    jobs_by_path: dict[Path, list[TorrentJob]] = {}
+    for job in jobs:
+        jobs_by_path.setdefault(Path(os.path.abspath(job.search_path)), []).append(job)
+
+    groups: dict[Path, list[TorrentJob]] = {}
+    for search_path in sorted(jobs_by_path, key=lambda path: len(path.parts)):  # ancestors come first
+        root: Path = next((parent for parent in search_path.parents if parent in groups), search_path)
+        groups.setdefault(root, []).extend(jobs_by_path[search_path])
+    return groups
+
+
+ROOT_WALKS_MAX_FILES = 500_000  # Files of every size kept across pages by RootWalks, in all roots together.
+
+
+class RootWalks:
+    """Search roots indexed whole for one page of a run and kept for the later pages.
+
+    At most max_files files are kept in all: the least recently used roots are dropped to make room, and
+    a root with more files than that is never indexed whole, its pages go back to walking it for the
+    sizes they need (cheap with the scan index).
+    """
+
+    def __init__(self, max_files: int = ROOT_WALKS_MAX_FILES):
+        self.max_files = max_files
+        self.too_big: set[Path] = set()
+        self._walks: dict[Path, SizeIndex] = {}  # In order of use, the least recently used first.
+        self._lock = threading.Lock()
+
+    def get(self, search_root: Path) -> tuple[Path, SizeIndex] | None:
+        """The walk of search_root, or of a root above it."""
+        with self._lock:
+            for root in (search_root, *search_root.parents):
+                size_index = self._walks.pop(root, None)
+                if size_index is not None:
+                    self._walks[root] = size_index
+                    return root, size_index
+        return None
+
+    def put(self, search_root: Path, size_index: SizeIndex) -> None:
+        with self._lock:
+            self._walks[search_root] = size_index
+            kept = sum(len(walk) for walk in self._walks.values())
+            while kept > self.max_files:
+                kept -= len(self._walks.pop(next(iter(self._walks))))
+
+
+def scan_search_root(
+    search_root: Path,
+    root_jobs: list[TorrentJob],
+    use_hardlinks: bool,
+    scan_index: ScanIndex | None,
+    scan_workers: int,
+    root_walks: RootWalks | None = None,
+) -> SizeIndex:
+    """Walks search_root once for all root_jobs, indexing only the sizes they need.
+
+    With root_walks, a root is indexed whole if it fits, so later pages can reuse it, and a root at or
+    below one walked for an earlier page isn't walked again at all.
+    """
+    if root_walks is not None:
+        walk = root_walks.get(search_root)
+        if walk is not None:
+            print(f"\nReusing the files found in '{walk[0]}' for {len(root_jobs)} torrent(s)")
+            return walk[1]
+    # Every torrent below this root shares one walk of it.
+    root_sizes: set[int] = set().union(*(job.sizes for job in root_jobs))
+    print(f"\nScanning files in '{search_root}' for {len(root_jobs)} torrent(s)")
+    with PROFILER.record("scan", root=str(search_root), torrents=len(root_jobs)):
+        if root_walks is not None and search_root not in root_walks.too_big:
+            size_index = get_matching_files_in_dir_and_subdirs(
+                search_root, None, use_hardlinks, scan_index, scan_workers, max_files=root_walks.max_files
+            )
+            if len(size_index) <= root_walks.max_files:
+                root_walks.put(search_root, size_index)
+                return size_index
+            root_walks.too_big.add(search_root)
+            print(f"Too many files to keep for the next pages, scanning '{search_root}' again for the sizes needed now")
+        return get_matching_files_in_dir_and_subdirs(search_root, root_sizes, use_hardlinks, scan_index, scan_workers)
+
+
+def scan_groups(
+    groups: dict[Path, list[TorrentJob]],
+    use_hardlinks: bool,
+    scan_index: ScanIndex | None,
+    scan_workers: int,
+    root_walks: RootWalks | None = None,
+) -> Iterator[tuple[TorrentJob, SizeIndex]]:
+    """Fetches file lists and scans each search root, one after the other."""
+    for search_root, root_jobs in groups.items():
+        root_jobs = [load_torrent_files(job) for job in root_jobs]
+        size_index = scan_search_root(search_root, root_jobs, use_hardlinks, scan_index, scan_workers, root_walks)
+        for job in root_jobs:
+            yield job, size_index
+
+
+def manifest_groups(
+    groups: dict[Path, list[TorrentJob]],
+    use_hardlinks: bool,
+    manifest: Manifest,
+) -> Iterator[tuple[TorrentJob, SizeIndex]]:
+    """Like scan_groups(), but takes the files from a manifest, read once for all search roots.
 
-        print(f"Search directory '{search_path}'\nDownload directory '{download_path}'")
+    Only files of the sizes these torrents need are kept, so the manifest is read again for every page of
+    TORRENT_PAGE_SIZE torrents rather than held in memory whole.
+    """
+    with ThreadPoolExecutor(max_workers=API_CONCURRENCY) as pool:
+        jobs: list[TorrentJob] = list(pool.map(load_torrent_files, [job for root_jobs in groups.values() for job in root_jobs]))
+    sizes: set[int] = wanted_sizes(set().union(*(job.sizes for job in jobs)), use_hardlinks)
+    print(f"\nReading manifest '{manifest.path}' for {len(jobs)} torrent(s)")
+    with PROFILER.record("scan", root=str(manifest.path), torrents=len(jobs)):
+        size_index = load_manifest(manifest, sizes)
+    for job in jobs:
+        yield job, size_index
 
-        # Unfortunately hashing individual files isn't possible (or at least practical), so we match with their sizes.
-        torrent_file_sizes: set[int] = {file.size for file in torrent.files if file.size}
 
-        print("Scanning files in search directory")
-        files_in_directory: list[tuple[str, int]] = get_matching_files_in_dir_and_subdirs(search_path, torrent_file_sizes, use_hardlinks)
-        print(f"Found {len(files_in_directory)} matches in '{search_path}'")
-        made_change: bool = match(torrent, files_in_directory, match_extension, download_path, use_hardlinks, is_dry_run, no_redownload)
+_PIPELINE_DONE = object()
 
-        if input_download_path and input_download_path != torrent.save_path and not is_dry_run:
-            print(f"Changing torrent save location to {input_download_path}")
-            qb_client.torrents_set_location(torrent_hashes=torrent_hash, location=str(input_download_path))
+
+class _HeldOutput:
+    """Stands in for sys.stdout, holding back what other threads print until the main thread releases it.
+
+    The prefetch threads print while the main thread may be showing a prompt, which would garble it.
+    """
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self.held: list[str] = []
+        self._lock = threading.Lock()
+        self._main = threading.current_thread()
+
+    def write(self, text: str) -> int:
+        if threading.current_thread() is self._main:
+            return self.stream.write(text)
+        with self._lock:
+            self.held.append(text)
+        return len(text)
+
+    def release(self) -> None:
+        with self._lock:
+            held, self.held = self.held, []
+        self.stream.write("".join(held))
+        self.stream.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stream, name)
+
+
+def scan_groups_pipelined(
+    groups: dict[Path, list[TorrentJob]],
+    use_hardlinks: bool,
+    scan_index: ScanIndex | None,
+    scan_workers: int,
+    pipeline_jobs: int,
+    root_walks: RootWalks | None = None,
+) -> Iterator[tuple[TorrentJob, SizeIndex]]:
+    """Same as scan_groups, but prefetches file lists and scans upcoming roots while the caller works.
+
+    The fetching and scanning run on an asyncio loop in a background thread, with the blocking calls
+    pushed to a thread pool. Finished torrents are handed over through a bounded queue, so the caller
+    (renames, prompts) stays on the main thread and the prefetch never runs more than a few roots ahead.
+    What the prefetch prints is held back and printed as the caller takes the next torrent.
+    If the caller stops early (an error, Ctrl+C), the prefetch is cancelled instead of waiting on the queue forever.
+    """
+    import asyncio  # pylint: disable=C0415  # Only needed with --jobs, and slow to import.
+
+    ready: queue.Queue = queue.Queue(maxsize=pipeline_jobs)
+    cancelled = threading.Event()
+    running: dict[str, Any] = {}  # The prefetch's loop and task, to cancel them from the caller's thread.
+
+    def hand_over(item: Any) -> bool:
+        """Puts item in the queue, giving up once the caller has stopped taking items."""
+        while not cancelled.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def prefetch() -> None:
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=pipeline_jobs + API_CONCURRENCY)
+        scan_slots = asyncio.Semaphore(pipeline_jobs)
+        api_slots = asyncio.Semaphore(API_CONCURRENCY)
+
+        async def fetch_files(job: TorrentJob) -> TorrentJob:
+            async with api_slots:
+                if cancelled.is_set():
+                    return job
+                return await loop.run_in_executor(executor, load_torrent_files, job)
+
+        async def prepare_group(search_root: Path, root_jobs: list[TorrentJob]) -> None:
+            async with scan_slots:
+                if cancelled.is_set():
+                    return
+                root_jobs = list(await asyncio.gather(*(fetch_files(job) for job in root_jobs)))
+                if cancelled.is_set():
+                    return
+                size_index = await loop.run_in_executor(
+                    executor,
+                    scan_search_root,
+                    search_root,
+                    root_jobs,
+                    use_hardlinks,
+                    scan_index,
+                    scan_workers,
+                    root_walks,
+                )
+            for job in root_jobs:
+                if not await loop.run_in_executor(executor, hand_over, (job, size_index)):
+                    return
+
+        running["loop"], running["task"] = loop, asyncio.current_task()
+        try:
+            await asyncio.gather(*(prepare_group(search_root, root_jobs) for search_root, root_jobs in groups.items()))
+        finally:
+            if sys.version_info >= (3, 9):
+                executor.shutdown(wait=False, cancel_futures=True)
+            else:
+                executor.shutdown(wait=False)
+
+    def run() -> None:
+        try:
+            asyncio.run(prefetch())
+        except BaseException as e:  # pylint: disable=W0718
+            hand_over(e)
+        hand_over(_PIPELINE_DONE)
+
+    output = _HeldOutput(sys.stdout)
+    sys.stdout = output  # type: ignore[assignment]
+    try:
+        threading.Thread(target=run, name="prefetch", daemon=True).start()
+        while True:
+            item = ready.get()
+            output.release()
+            if item is _PIPELINE_DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+        if "loop" in running:
+            with contextlib.suppress(RuntimeError):  # The loop may have finished already.
+                running["loop"].call_soon_threadsafe(running["task"].cancel)
+        sys.stdout = output.stream
+        output.release()
+
+
+def process_torrent(
+    qb_client: Client,
+    job: TorrentJob,
+    size_index: SizeIndex,
+    options: MatchOptions,
+    input_download_path: Path | None,
+    rename_by_path: bool,
+    plan: Plan | None = None,
+    rechecks: RecheckScheduler | None = None,
+):
+    with PROFILER.record("torrent", name=job.torrent.name, hash=job.torrent.hash.upper()):
+        torrent = job.torrent
+        torrent_hash = torrent.hash.upper()
+        if job.cached:
+            if input_download_path is None and files_in_place(job, size_index):
+                print(f"\nAll files of '{torrent.name}' are in place, skipped")
+                return
+            job = load_torrent_files(job, use_cache=False)  # Match against the current names.
+        print(f"\nMatching torrent: {torrent.name}")
+        files_in_directory: SizeIndexView = size_index.view(job.search_path)
+        print(f"Found {files_in_directory.count(job.sizes)} matches in '{job.search_path}'")
+        changes: TorrentChanges = (
+            PlannedTorrentChanges(plan, torrent_hash, torrent.name) if plan is not None
+            else TorrentChanges(qb_client, torrent_hash, rename_by_path, rechecks=rechecks)
+        )
+        made_change: bool = match(torrent, job.files, changes, files_in_directory, job.download_path, options)
+
+        if input_download_path and input_download_path != torrent.save_path and not options.is_dry_run:
+            with PROFILER.phase("api"):
+                changes.set_location(input_download_path)
             print(f"{Fore.LIGHTMAGENTA_EX}Rechecking torrent{Style.RESET_ALL}")
-            qb_client.torrents_recheck(torrent_hash)
+            with PROFILER.phase("api"):
+                changes.recheck(input_download_path)
 
-        elif made_change and not is_dry_run:
+        elif made_change and not options.is_dry_run:
             print("Change made, rechecking torrent...")
-            qb_client.torrents_recheck(torrent_hash)
+            with PROFILER.phase("api"):
+                changes.recheck(job.download_path)
 
-        if is_dry_run:
+        if options.is_dry_run:
             print(f"{Fore.YELLOW}Performed a dry run, nothing was modified{Style.RESET_ALL}")
 
 
+class ShardTorrent(NamedTuple):
+    """What a shard worker needs of a torrent, without the API client a TorrentDictionary drags along."""
+    hash: str
+    name: str
+    save_path: str
+
+
+class Shard(NamedTuple):
+    """The torrents whose search paths are on one device, matched in a worker process."""
+    device: int
+    jobs: list[tuple[ShardTorrent, str, str, list[dict[str, Any]]]]  # torrent, search path, download path, files
+    options: MatchOptions
+    input_download_path: Path | None
+    scan_workers: int
+    use_scan_index: bool
+
+
+def run_shard(shard: Shard) -> tuple[list[dict[str, Any]], str]:
+    """Scans and matches one shard in a worker process, returning the plan entries and everything it printed.
+
+    Changes go into a plan so the coordinator makes them over its own API session.
+    """
+    plan = Plan()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        scan_index: ScanIndex | None = ScanIndex(INDEX_FILE, shared=True) if shard.use_scan_index else None
+        try:
+            jobs: list[TorrentJob] = []
+            for torrent, search_path, download_path, files in shard.jobs:
+                torrent_files = [TorrentFile(file) for file in files]
+                sizes = {file.size for file in torrent_files if file.size}
+                jobs.append(TorrentJob(torrent, Path(search_path), Path(download_path), torrent_files, sizes))  # type: ignore[arg-type]
+            for search_root, root_jobs in group_by_search_root(jobs).items():
+                size_index = scan_search_root(search_root, root_jobs, shard.options.use_hardlinks, scan_index, shard.scan_workers)
+                for job in root_jobs:
+                    process_torrent(None, job, size_index, shard.options, shard.input_download_path, True, plan)  # type: ignore[arg-type]
+        finally:
+            if scan_index:
+                scan_index.close()
+    return plan.torrents, output.getvalue()
+
+
+def resolve_unresolved(qb_client: Client, job: TorrentJob, entry: dict[str, Any], options: MatchOptions, rename_by_path: bool) -> None:
+    """Matches the files a shard couldn't decide on again, against just their candidates, prompting as usual."""
+    names: set[str] = {unresolved["name"] for unresolved in entry["unresolved"]}
+    taken: set[str] = {rename["disk_file"] for rename in entry["renames"]}
+    paths: set[str] = {path for unresolved in entry["unresolved"] for path, _ in unresolved["candidates"]} - taken
+    size_index = SizeIndex()
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        size_index.add(path, st.st_size, st.st_dev, st.st_ino, getattr(st, "st_blocks", -1))
+    changes = TorrentChanges(qb_client, entry["hash"], rename_by_path)
+    print(f"\nResolving {len(names)} file(s) of torrent: {job.torrent.name}")
+    match(job.torrent, job.files, changes, size_index.freeze().view(job.search_path), job.download_path, options, only=names)
+
+
+def resolve_conflicts(qb_client: Client, job: TorrentJob, entry: dict[str, Any], options: MatchOptions, rename_by_path: bool) -> None:
+    """Handles the renames a shard found would conflict, as match() handles a failed rename."""
+    files_by_index: dict[int, TorrentFile] = {int(file.index): file for file in job.files}
+    changes = TorrentChanges(qb_client, entry["hash"], rename_by_path)
+    print(f"\nResolving {len(entry['conflicts'])} conflicting rename(s) of torrent: {job.torrent.name}")
+    for conflict in entry["conflicts"]:
+        print(f"'{conflict['old']}' can't be renamed to '{conflict['new']}'")
+        pending = PendingRename(files_by_index[int(conflict["index"])], conflict["old"], conflict["new"], conflict["disk_file"])
+        handle_failed_rename(changes, pending, job.download_path, options.no_redownload)
+    changes.send_priorities()
+
+
+def match_sharded(
+    qb_client: Client,
+    jobs: list[TorrentJob],
+    options: MatchOptions,
+    input_download_path: Path | None,
+    rename_by_path: bool,
+    plan: Plan | None,
+    shards: int,
+    scan_workers: int,
+    use_scan_index: bool,
+    rebuild_scan_index: bool,
+    rechecks: RecheckScheduler | None = None,
+) -> None:
+    """Scans and matches the torrents of each device in its own process, up to shards at once.
+
+    Torrents are split by the st_dev of their search path, so disks are scanned in parallel and the
+    matching itself isn't held back by the GIL. This process keeps the only API session: it fetches
+    the file lists, makes the changes the workers send back and asks about the files they couldn't
+    decide on, one prompt at a time.
+    """
+    from concurrent.futures import ProcessPoolExecutor  # pylint: disable=C0415  # Pulls in multiprocessing.
+
+    if use_scan_index and rebuild_scan_index:
+        ScanIndex(INDEX_FILE, rebuild=True).close()
+    if not jobs:
+        return
+    with ThreadPoolExecutor(max_workers=API_CONCURRENCY) as pool:
+        # Workers can't fetch a fresh list when a cached one turns out stale, so the cache isn't read here.
+        jobs = list(pool.map(lambda job: load_torrent_files(job, use_cache=False), jobs))
+
+    by_device: dict[int, list[TorrentJob]] = {}
+    for job in jobs:
+        try:
+            device: int = os.stat(job.search_path).st_dev
+        except OSError:
+            device = -1
+        by_device.setdefault(device, []).append(job)
+    jobs_by_hash: dict[str, TorrentJob] = {job.torrent.hash.upper(): job for job in jobs}
+    worker_options = options._replace(verify_pieces=False, interactive=False)  # Workers have no API session to verify with.
+
+    coordinator_index: ScanIndex | None = ScanIndex(INDEX_FILE, shared=True) if use_scan_index else None
+    CONTENT_DIGESTS.scan_index = TORRENT_FILE_CACHE.scan_index = coordinator_index
+    for job in jobs:
+        TORRENT_FILE_CACHE.put(job.torrent, job.files)  # For the runs without --shards.
+    processes = min(shards, len(by_device))
+    print(f"\nMatching {len(jobs)} torrent(s) on {len(by_device)} device(s) in {processes} process(es)")
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures: list[Future] = [
+                pool.submit(
+                    run_shard,
+                    Shard(
+                        device,
+                        [
+                            (
+                                ShardTorrent(job.torrent.hash.upper(), job.torrent.name, job.torrent.save_path),
+                                str(job.search_path),
+                                str(job.download_path),
+                                [dict(file) for file in job.files],
+                            )
+                            for job in device_jobs
+                        ],
+                        worker_options,
+                        input_download_path,
+                        scan_workers,
+                        use_scan_index,
+                    ),
+                )
+                for device, device_jobs in by_device.items()
+            ]
+            for future in as_completed(futures):
+                entries, output = future.result()
+                print(output, end="")
+                for entry in entries:
+                    if plan is not None:
+                        plan.torrents.append(entry)
+                        continue
+                    if entry["unresolved"]:
+                        resolve_unresolved(qb_client, jobs_by_hash[entry["hash"]], entry, options, rename_by_path)
+                    if entry["conflicts"] and options.interactive:
+                        resolve_conflicts(qb_client, jobs_by_hash[entry["hash"]], entry, options, rename_by_path)
+                    apply_plan_entry(qb_client, entry, rename_by_path, rechecks)
+    finally:
+        CONTENT_DIGESTS.scan_index = TORRENT_FILE_CACHE.scan_index = None
+        if coordinator_index:
+            coordinator_index.close()
+
+
+class TorrentFileRef(NamedTuple):
+    torrent: TorrentDictionary
+    torrent_file: TorrentFile
+
+
+def find_torrents_for_files(
+    find_path: Path,
+    verify_pieces: bool = False,
+    scan_workers: int = DEFAULT_SCAN_WORKERS,
+    use_scan_index: bool = True,
+    rebuild_scan_index: bool = False,
+):
+    """Reports, for each file below find_path, the torrent files it could be.
+
+    Every file of every torrent goes into one map keyed by size, then find_path is walked once and each
+    disk file is looked up in it, so the work grows with torrents + disk files rather than their product.
+    """
+    qb_client: Client = init_client()
+    torrents: TorrentInfoList = qb_client.torrents_info()
+    print("Connected to api!")
+    if not torrents:
+        sys.exit(f"{Fore.RED}No torrents found found anywhere in your qBittorrent{Style.RESET_ALL}")
+
+    scan_index: ScanIndex | None = ScanIndex(INDEX_FILE, rebuild=rebuild_scan_index) if use_scan_index else None
+    TORRENT_FILE_CACHE.scan_index = scan_index
+    print(f"Fetching file lists of {len(torrents)} torrent(s)")
+    with ThreadPoolExecutor(max_workers=API_CONCURRENCY) as pool:
+        # Listed names must be current, and nothing here would notice a stale one, so lists are only stored.
+        file_lists: list[list[TorrentFile]] = [
+            files for files, _ in pool.map(lambda torrent: fetch_torrent_files(torrent, use_cache=False), torrents)
+        ]
+    TORRENT_FILE_CACHE.scan_index = None
+    torrent_files_by_size: dict[int, list[TorrentFileRef]] = {}
+    files_by_hash: dict[str, list[TorrentFile]] = {}
+    for torrent, torrent_files in zip(torrents, file_lists):
+        files_by_hash[torrent["hash"]] = torrent_files
+        for torrent_file in torrent_files:
+            if torrent_file.size:
+                torrent_files_by_size.setdefault(torrent_file.size, []).append(TorrentFileRef(torrent, torrent_file))
+    verifiers: dict[str, PieceVerifier] = {}
+
+    print(f"Scanning files in '{find_path}'")
+    walker = TreeWalker(scan_workers, scan_index)
+    found_count = 0
+    try:
+        for disk_file in walker.walk(find_path, set(torrent_files_by_size)):
+            refs = torrent_files_by_size[disk_file.size]
+            if verify_pieces:
+                confirmed: list[tuple[TorrentFileRef, bool | None]] = []
+                for ref in refs:
+                    torrent_hash = ref.torrent["hash"]
+                    if torrent_hash not in verifiers:
+                        verifiers[torrent_hash] = PieceVerifier(ref.torrent, files_by_hash[torrent_hash])
+                    result = verifiers[torrent_hash].check(ref.torrent_file, disk_file.path)
+                    if result is not False:
+                        confirmed.append((ref, result))
+            else:
+                confirmed = [(ref, None) for ref in refs]
+            if not confirmed:
+                continue
+
+            found_count += 1
+            print(f"\n{Fore.GREEN}{disk_file.path}{Style.RESET_ALL} ({disk_file.size} bytes)")
+            for ref, verified in confirmed:
+                note = " (verified)" if verified else ""
+                print(f"    {ref.torrent.name} [{ref.torrent['hash'].upper()}] file #{ref.torrent_file.index} '{ref.torrent_file.name}'{note}")
+    finally:
+        if scan_index:
+            scan_index.close()
+    print(f"\n{found_count} of {walker.files_seen} files in '{find_path}' could belong to a torrent")
+
+
+class Inotify:
+    """Minimal inotify(7) binding over ctypes, Linux only."""
+
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+    _EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; followed by len bytes of name.
+
+    def __init__(self):
+        import ctypes  # pylint: disable=C0415
+        import ctypes.util  # pylint: disable=C0415
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._get_errno = ctypes.get_errno
+        self.fd: int = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self._get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, dir_path: str) -> int:
+        wd: int = self._libc.inotify_add_watch(self.fd, os.fsencode(dir_path), self.WATCH_MASK)
+        if wd < 0:
+            errno = self._get_errno()
+            raise OSError(errno, os.strerror(errno), dir_path)
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: float) -> list[tuple[int, int, str]]:
+        """(wd, mask, name) of the events that arrive within timeout seconds."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        events: list[tuple[int, int, str]] = []
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+                offset += name_length
+                events.append((wd, mask, name))
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class LiveLibrary:
+    """Every file below the watched search roots, kept current from inotify events.
+
+    Roots are walked once when first needed. After that, inotify reports each created, written, moved or
+    deleted entry and only those are stat'ed again. Where inotify isn't available (not Linux, or out of
+    watches), a root is walked again before each use instead, which the scan index keeps cheap.
+    """
+
+    def __init__(self, scan_index: ScanIndex | None, workers: int = DEFAULT_SCAN_WORKERS):
+        self.scan_index = scan_index
+        self.workers = workers
+        self.roots: set[str] = set()
+        self.files: dict[str, DiskFile] = {}
+        self.by_size: dict[int, set[str]] = {}
+        self._dir_wds: dict[str, int] = {}
+        self._wd_dirs: dict[int, str] = {}
+        self._stale = False  # Events were lost, every root needs a fresh walk.
+        self.inotify: Inotify | None = None
+        try:
+            self.inotify = Inotify()
+        except (AttributeError, OSError) as e:  # No inotify_init1 in this libc, or not Linux at all.
+            print(f"{Fore.YELLOW}inotify unavailable ({e}), search roots will be rescanned when needed{Style.RESET_ALL}")
+
+    def close(self) -> None:
+        if self.inotify:
+            self.inotify.close()
+
+    def _add(self, disk_file: DiskFile) -> None:
+        self._remove(disk_file.path)
+        self.files[disk_file.path] = disk_file
+        self.by_size.setdefault(disk_file.size, set()).add(disk_file.path)
+
+    def _remove(self, path: str) -> None:
+        old = self.files.pop(path, None)
+        if old:
+            same_size = self.by_size[old.size]
+            same_size.discard(path)
+            if not same_size:
+                del self.by_size[old.size]
+
+    def _stat(self, path: str) -> None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._remove(path)
+            return
+        if stat.S_ISREG(st.st_mode):
+            self._add(DiskFile(path, st.st_size, st.st_mtime_ns, st.st_dev, st.st_ino, getattr(st, "st_blocks", -1)))
+
+    def _watch(self, dir_path: str) -> None:
+        if not self.inotify:
+            return
+        try:
+            wd = self.inotify.add_watch(dir_path)
+        except OSError as e:
+            print(f"{Fore.YELLOW}Warning: can't watch '{dir_path}' ({e}), falling back to rescans{Style.RESET_ALL}")
+            self.inotify.close()
+            self.inotify = None
+            return
+        self._dir_wds[dir_path] = wd
+        self._wd_dirs[wd] = dir_path
+
+    def _walk(self, dir_path: str) -> None:
+        walker = TreeWalker(self.workers, self.scan_index)
+        for disk_file in walker.walk(dir_path, on_dir=self._watch):
+            self._add(disk_file)
+        PROFILER.count("files_scanned", walker.files_seen)
+        PROFILER.count("dirs_scanned", walker.dirs_seen)
+        if self.scan_index:
+            self.scan_index.commit()
+
+    def _forget_dir(self, dir_path: str) -> None:
+        prefix = os.path.join(dir_path, "")
+        for path in [path for path in self.files if path.startswith(prefix)]:
+            self._remove(path)
+        for watched in [watched for watched in self._dir_wds if watched == dir_path or watched.startswith(prefix)]:
+            wd = self._dir_wds.pop(watched)
+            self._wd_dirs.pop(wd, None)
+            if self.inotify:
+                self.inotify.rm_watch(wd)
+
+    def root_for(self, search_path: Path) -> str | None:
+        path = os.path.abspath(search_path)
+        return next((root for root in self.roots if path == root or path.startswith(os.path.join(root, ""))), None)
+
+    def prepare(self, search_path: Path) -> None:
+        """Makes sure the files below search_path are known and current."""
+        if self._stale:
+            print("Lost track of file changes, rescanning every search root")
+            self._stale = False
+            for root in list(self.roots):
+                self._forget_dir(root)
+                self._walk(root)
+        root = self.root_for(search_path)
+        if root and self.inotify:
+            return
+        root = root or os.path.abspath(search_path)
+        print(f"\nScanning files in '{root}'")
+        self._forget_dir(root)
+        self._walk(root)
+        # A new root may contain roots walked earlier, those are covered now.
+        prefix = os.path.join(root, "")
+        self.roots = {other for other in self.roots if not other.startswith(prefix)} | {root}
+
+    def size_index(self, sizes: set[int]) -> SizeIndex:
+        size_index = SizeIndex()
+        for size in sizes:
+            for path in self.by_size.get(size, ()):
+                disk_file = self.files[path]
+                size_index.add(path, size, disk_file.dev, disk_file.ino, disk_file.blocks)
+        return size_index.freeze()
+
+    def wait(self, timeout: float) -> None:
+        """Applies the file changes reported over the next timeout seconds."""
+        if not self.inotify:
+            time.sleep(timeout)
+            return
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self.inotify.read(max(0.0, deadline - time.monotonic()))
+            to_stat: set[str] = set()
+            for wd, mask, name in events:
+                if mask & Inotify.IN_Q_OVERFLOW:
+                    self._stale = True
+                    continue
+                dir_path = self._wd_dirs.get(wd)
+                if dir_path is None:
+                    continue
+                if mask & Inotify.IN_IGNORED:  # The directory itself is gone.
+                    self._wd_dirs.pop(wd, None)
+                    self._dir_wds.pop(dir_path, None)
+                    continue
+                path = os.path.join(dir_path, name)
+                if mask & Inotify.IN_ISDIR:
+                    if mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                        self._forget_dir(path)
+                    elif mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                        self._walk(path)
+                elif mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                    to_stat.discard(path)
+                    self._remove(path)
+                else:
+                    to_stat.add(path)  # Several events for one file in a batch cost one stat.
+            for path in to_stat:
+                self._stat(path)
+            PROFILER.count("watch_events", len(events))
+            if time.monotonic() >= deadline:
+                return
+
+
+WATCH_INTERVAL = 5.0  # Seconds between sync/maindata polls.
+WATCH_STATES = {"missingFiles", "error"}  # Torrents entering one of these get matched.
+METADATA_STATES = {"metaDL", "forcedMetaDL", "checkingResumeData"}  # No file list to match yet.
+
+
+def torrents_to_match(
+    known: dict[str, dict[str, Any]],
+    pending: set[str],
+    maindata: dict[str, Any],
+    first_update: bool,
+) -> list[str]:
+    """Merges one sync/maindata response into known and returns the hashes worth matching now.
+
+    Those are torrents added since the first update, and torrents that just entered a WATCH_STATES state.
+    Torrents still waiting for metadata are kept in pending until they have a file list.
+    """
+    updates: dict[str, dict[str, Any]] = maindata.get("torrents") or {}
+    if maindata.get("full_update") and not first_update:  # The server reset our cursor.
+        for torrent_hash in set(known) - set(updates):
+            known.pop(torrent_hash)
+    for torrent_hash in maindata.get("torrents_removed") or []:
+        known.pop(torrent_hash, None)
+        pending.discard(torrent_hash)
+
+    due: list[str] = []
+    for torrent_hash, fields in updates.items():
+        previous: dict[str, Any] | None = known.get(torrent_hash)
+        current: dict[str, Any] = {**(previous or {}), **fields}
+        known[torrent_hash] = current
+        state = current.get("state")
+        if previous is None and not first_update:
+            pending.add(torrent_hash)
+        elif state in WATCH_STATES and (previous is None or previous.get("state") != state):
+            pending.add(torrent_hash)
+        if torrent_hash in pending and state not in METADATA_STATES:
+            pending.discard(torrent_hash)
+            due.append(torrent_hash)
+    return due
+
+
+def watch(
+    options: MatchOptions,
+    input_search_path: Path | None = None,
+    input_download_path: Path | None = None,
+    use_torrent_save_path_as_search_path: bool = False,
+    interval: float = WATCH_INTERVAL,
+    scan_workers: int = DEFAULT_SCAN_WORKERS,
+    use_scan_index: bool = True,
+    rebuild_scan_index: bool = False,
+    recheck_mode: str = "batch",
+    rechecks_per_device: int = RECHECKS_PER_DEVICE,
+):
+    """Keeps running, matching torrents as they are added or go missing.
+
+    sync/maindata is polled with its rid cursor, so each poll only returns the torrents that changed,
+    and the files of the search roots are kept in memory by LiveLibrary. Work per poll grows with the
+    rate of change rather than with the size of the library. Deferred rechecks start on polls with
+    nothing to match.
+    Losing the connection doesn't stop the watch: the next poll starts over with a full update, and
+    torrents that were due are matched then. A torrent that fails to match is reported and skipped.
+    """
+    qb_client: Client = init_client()
+    rename_by_path: bool = supports_path_renames(qb_client)
+    print(f"Connected to api! Watching for new and missing torrents every {interval:g}s, Ctrl+C to stop.")
+    scan_index: ScanIndex | None = ScanIndex(INDEX_FILE, rebuild=rebuild_scan_index) if use_scan_index else None
+    CONTENT_DIGESTS.scan_index = TORRENT_FILE_CACHE.scan_index = scan_index
+    library = LiveLibrary(scan_index, scan_workers)
+    rechecks = RecheckScheduler(qb_client, recheck_mode, rechecks_per_device)
+    known: dict[str, dict[str, Any]] = {}
+    pending: set[str] = set()
+    rid = 0
+    first_update = True
+    try:
+        while True:
+            unmatched: set[str] = set()  # Due torrents not tried yet, in case the connection drops.
+            try:
+                maindata = qb_client.sync_maindata(rid=rid)
+                due: list[str] = torrents_to_match(known, pending, maindata, first_update=first_update)
+                unmatched.update(due)
+                rid = maindata.get("rid", rid)
+                first_update = False
+                for torrent_hash in maindata.get("torrents_removed") or []:
+                    TORRENT_FILE_CACHE.forget(torrent_hash)
+                if due:
+                    for torrent in qb_client.torrents_info(torrent_hashes=due):
+                        try:
+                            job = prepare_torrent_job(torrent, input_search_path, input_download_path, use_torrent_save_path_as_search_path)
+                            if not job:
+                                continue
+                            job = load_torrent_files(job, use_cache=False)  # Due torrents need matching, against current names.
+                            library.prepare(job.search_path)
+                            size_index = library.size_index(wanted_sizes(job.sizes, options.use_hardlinks))
+                            process_torrent(qb_client, job, size_index, options, input_download_path, rename_by_path, rechecks=rechecks)
+                        except APIConnectionError:
+                            raise
+                        except Exception as e:  # pylint: disable=W0718  # One bad torrent mustn't end the watch.
+                            print(f"{Fore.RED}Failed to match torrent '{torrent.name}': {e!r}{Style.RESET_ALL}")
+                        finally:
+                            unmatched.discard(torrent.hash)
+                if rechecks.mode == "batch" or not due:
+                    rechecks.pump()
+                rechecks.list_skipped()
+            except APIConnectionError as e:
+                print(f"{Fore.RED}Lost the connection to qBittorrent: {e}. Retrying in {interval:g}s.{Style.RESET_ALL}")
+                pending.update(unmatched)  # Matched once the full update after the reconnect lists them again.
+                rid = 0
+            library.wait(interval)
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+        rechecks.finish(wait=False)
+    finally:
+        CONTENT_DIGESTS.scan_index = TORRENT_FILE_CACHE.scan_index = None
+        library.close()
+        if scan_index:
+            scan_index.close()
+
+
 def main() -> None:
 
     init()  # colorama
@@ -490,14 +3198,36 @@ def main() -> None:
     parser.add_argument("-dry", action="store_true", help="Performs a dry run without modifying anything.")
     parser.add_argument("-l", "-link", action="store_true", help="Creates hardlinks instead of renaming.")
     parser.add_argument("-nodl", "-no_download", action="store_true", help="If file not found on disk, tell qBittorrent to set priority of that file to 0.")
-    #parser.add_argument("-f", "-find", action="store_true", help="Searches filenames to find matching torrents, when that file can't be found in another torrent.")
+    parser.add_argument("-verify", action="store_true", help="Resolves multiple matches by checking them against the torrent's piece hashes.")
+    parser.add_argument("-workers", "--workers", type=int, default=DEFAULT_SCAN_WORKERS, help=f"Number of directories scanned in parallel (default {DEFAULT_SCAN_WORKERS}). Raise it for network storage.")
+    parser.add_argument("-jobs", "--jobs", type=int, default=1, help="Fetches file lists and scans up to N search roots ahead while the current torrent is being matched.")
+    parser.add_argument("-auto", "--auto-pick", type=float, nargs="?", const=AUTO_PICK_THRESHOLD, default=None, metavar="THRESHOLD", help=f"Picks the best scoring of multiple matches without asking, if its score (0-1) is at least THRESHOLD (default {AUTO_PICK_THRESHOLD}).")
+    parser.add_argument("-plan", "--plan", default=None, metavar="FILE", help="Writes every change to FILE (JSON) instead of making it. Never prompts.")
+    parser.add_argument("-apply", "--apply", default=None, metavar="FILE", help="Carries out the changes of a plan written by --plan, without scanning.")
+    parser.add_argument("-rebuild_index", "--rebuild-index", action="store_true", help=f"Discards the on-disk scan index ({INDEX_FILE}) and rescans everything.")
+    parser.add_argument("-no_index", "--no-index", action="store_true", help="Scans the disk without reading or writing the scan index.")
+    parser.add_argument("-f", "-find", default=None, metavar="DIR", help="Lists the torrents each file in DIR could belong to, matched by size (and piece hashes with -verify).")
+    parser.add_argument("-shards", "--shards", type=int, default=1, metavar="N", help="Scans and matches the torrents of each disk (by the device of their search path) in its own process, up to N at once. Prompts and API calls stay in the main process.")
+    parser.add_argument("-watch", "--watch", type=float, nargs="?", const=WATCH_INTERVAL, default=None, metavar="SECONDS", help=f"Keeps running and matches torrents as they are added or go missing, checking every SECONDS (default {WATCH_INTERVAL:g}). Never prompts.")
+    parser.add_argument("-manifest", "--manifest", default=None, metavar="FILE", help="Takes the files from FILE (find -printf output, CSV or JSON lines, optionally .gz/.bz2/.xz) instead of scanning the disk. Read again for every 500 torrents.")
+    parser.add_argument("-remap", "--remap", action="append", default=[], metavar="REMOTE=LOCAL", help="Replaces the path prefix REMOTE in the manifest with LOCAL. Can be given several times.")
+    parser.add_argument("-recheck", "--recheck", choices=RECHECK_MODES, default="batch", help="batch: starts rechecks during the run, a few per disk at a time (default). defer: starts them after all torrents are matched. off: only lists the torrents that need one.")
+    parser.add_argument("-recheck_limit", "--recheck-limit", type=int, default=RECHECKS_PER_DEVICE, metavar="N", help=f"Rechecks running at once per disk (default {RECHECKS_PER_DEVICE}).")
+    parser.add_argument("-profile", "--profile", nargs="?", const="-", default=None, metavar="FILE", help="Times every phase per torrent and per scanned directory. Writes JSON lines to FILE, or prints a summary table if no FILE is given.")
+    parser.add_argument("-cprofile", "--cprofile", default=None, metavar="FILE", help="Runs the matcher under cProfile and dumps the stats to FILE (view with `python -m pstats FILE`).")
 
     args = parser.parse_args()
 
+    if args.apply:
+        plan_file = Path(args.apply)
+        if not plan_file.is_file():
+            sys.exit(f"bad plan file: '{plan_file}' (either nonexistent or not a file)")
+        apply_plan(plan_file, args.recheck, args.recheck_limit, use_scan_index=not args.no_index)
+        return
+
     path: Path | None = Path(args.input) if args.input else None
     if path and path.exists() and path.is_file():  # TODO: determine whether it's a hash or a filepath.
-        with path.open(mode="r", encoding="utf-8") as file:
-            hashes: list[str] = [line.strip().upper() for line in file if line.strip()]
+        hashes: Iterable[str] = read_hashes(path)
     else:
         hashes = [args.input.upper()] if args.input else []
 
@@ -509,6 +3239,65 @@ def main() -> None:
     if input_download_path and (not input_download_path.exists() or input_download_path.is_file()):
         sys.exit(f"bad download path: '{input_download_path}' (either nonexistent or not a directory)")
 
+    if args.f:
+        find_path = Path(args.f)
+        if not find_path.is_dir():
+            sys.exit(f"bad find path: '{find_path}' (either nonexistent or not a directory)")
+        if args.input or args.a:
+            sys.exit("Cannot use '-find' together with '-a' or an input hash.")
+        find_torrents_for_files(
+            find_path,
+            verify_pieces=args.verify,
+            scan_workers=args.workers,
+            use_scan_index=not args.no_index,
+            rebuild_scan_index=args.rebuild_index,
+        )
+        return
+
+    manifest: Manifest | None = None
+    if args.remap and not args.manifest:
+        sys.exit("'--remap' rewrites manifest paths, it needs '--manifest'.")
+    if args.manifest:
+        manifest_file = Path(args.manifest)
+        if not manifest_file.is_file():
+            sys.exit(f"bad manifest: '{manifest_file}' (either nonexistent or not a file)")
+        if args.watch is not None or args.shards > 1:
+            sys.exit("A manifest is a snapshot of the disk, it can't be combined with '--watch' or '--shards'.")
+        remaps: list[tuple[str, str]] = []
+        for remap in args.remap:
+            remote, separator, local = remap.partition("=")
+            if not separator or not remote:
+                sys.exit(f"bad remap: '{remap}' (expected REMOTE=LOCAL)")
+            remaps.append((remote, local))
+        manifest = Manifest(manifest_file, remaps)
+
+    if args.watch is not None:
+        if args.input or args.a or args.plan:
+            sys.exit("'--watch' looks at every torrent by itself, it can't be combined with '-a', '--plan' or an input hash.")
+        watch(
+            options=MatchOptions(
+                match_extension=args.e,
+                use_hardlinks=args.l,
+                no_redownload=args.nodl,
+                is_dry_run=args.dry,
+                verify_pieces=args.verify,
+                auto_pick_threshold=AUTO_PICK_THRESHOLD if args.auto_pick is None else args.auto_pick,
+                interactive=False,
+            ),
+            input_search_path=input_search_path,
+            input_download_path=input_download_path,
+            use_torrent_save_path_as_search_path=args.fd,
+            interval=args.watch,
+            scan_workers=args.workers,
+            use_scan_index=not args.no_index,
+            rebuild_scan_index=args.rebuild_index,
+            recheck_mode=args.recheck,
+            rechecks_per_device=args.recheck_limit,
+        )
+        return
+
+    if args.plan and args.dry:
+        sys.exit("A plan doesn't modify anything already, '-dry' and '--plan' can't be combined.")
     if args.a and args.input:
         parser.print_help()
         sys.exit("Cannot use both '-a' and input hash in the same command.")
@@ -516,17 +3305,46 @@ def main() -> None:
         parser.print_help()
         sys.exit("Nothing to do? (must pass `-all` OR an input torrent hash/file)")
 
-    matcher(
-        input_torrent_hashes=hashes,
-        sync_all=args.a,
-        input_search_path=input_search_path,
-        input_download_path=input_download_path,
-        use_torrent_save_path_as_search_path=args.fd,
-        match_extension=args.e,
-        use_hardlinks=args.l,
-        no_redownload=args.nodl,
-        is_dry_run=args.dry,
-    )
+    auto_pick_threshold: float | None = args.auto_pick
+    if args.plan and auto_pick_threshold is None:
+        auto_pick_threshold = AUTO_PICK_THRESHOLD
+
+    if args.profile:
+        PROFILER.start(None if args.profile == "-" else Path(args.profile))
+    profile: cProfile.Profile | None = cProfile.Profile() if args.cprofile else None
+    if profile:
+        profile.enable()
+    try:
+        matcher(
+            input_torrent_hashes=hashes,
+            options=MatchOptions(
+                match_extension=args.e,
+                use_hardlinks=args.l,
+                no_redownload=args.nodl,
+                is_dry_run=args.dry,
+                verify_pieces=args.verify,
+                auto_pick_threshold=auto_pick_threshold,
+            ),
+            sync_all=args.a,
+            input_search_path=input_search_path,
+            input_download_path=input_download_path,
+            use_torrent_save_path_as_search_path=args.fd,
+            plan_file=Path(args.plan) if args.plan else None,
+            scan_workers=args.workers,
+            pipeline_jobs=args.jobs,
+            use_scan_index=not args.no_index,
+            rebuild_scan_index=args.rebuild_index,
+            shards=args.shards,
+            recheck_mode=args.recheck,
+            rechecks_per_device=args.recheck_limit,
+            manifest=manifest,
+        )
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.cprofile)
+        PROFILER.finish()
+
 
 if __name__ == "__main__":
     main()